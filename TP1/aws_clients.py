@@ -0,0 +1,26 @@
+#boto3 clients shared by every module
+import boto3
+from aws_config import AWS_CONFIG
+
+# A single session builds every client, and each service has one client for the whole process,
+# so that all the modules (and their threads) reuse the same connection pools instead of opening their own.
+# Low-level boto3 clients are thread-safe.
+session = boto3.Session()
+
+ec2 = session.client('ec2', config=AWS_CONFIG)
+elbv2 = session.client('elbv2', config=AWS_CONFIG)
+elb = session.client('elb', config=AWS_CONFIG)
+cloudwatch = session.client('cloudwatch', config=AWS_CONFIG)
+
+
+def warm_up_clients():
+    '''
+    This function opens the connections of the CloudWatch and ELB clients ahead of time with two cheap calls,
+    each returning at most one record, so that the TLS handshakes are not paid by the first real metric queries.
+    Errors are ignored: the real calls will retry and report them.
+    '''
+    try:
+        cloudwatch.describe_alarms(MaxRecords=1)
+        elbv2.describe_load_balancers(PageSize=1)
+    except Exception as e:
+        print(f"Could not warm up the AWS clients: {e}")
@@ -0,0 +1,112 @@
+#botocore configuration shared by every boto3 client
+from botocore.config import Config
+from botocore.exceptions import ClientError
+#for the jitter of the throttling backoff
+import random
+#for caching the AWS lookups
+import functools
+import threading
+import time
+
+# Region, connection pool and retry settings used by all the AWS clients of the lab.
+# Adaptive retries back off client-side when the many describe/wait polls get throttled,
+# and the larger pool lets concurrent threads reuse connections instead of opening new ones.
+# Short timeouts fail fast on a stuck connection, which the retries then replace,
+# and TCP keepalive keeps the pooled connections open between bursts of calls.
+AWS_CONFIG = Config(
+    region_name='us-east-1',
+    max_pool_connections=50,
+    retries={'mode': 'adaptive', 'max_attempts': 10},
+    connect_timeout=3,
+    read_timeout=15,
+    tcp_keepalive=True
+)
+
+
+# Error codes returned by AWS when the request rate is throttled
+THROTTLING_ERROR_CODES = {'Throttling', 'ThrottlingException', 'TooManyRequestsException', 'RequestLimitExceeded'}
+
+
+def call_with_backoff(function, max_attempts=5, max_delay=20, **kwargs):
+    '''
+    This function calls an AWS API method and retries it when the call is still throttled after botocore's own
+    adaptive retries, sleeping a random delay between 0 and 2**attempt seconds (capped by `max_delay`) before each
+    new attempt, so that concurrent callers do not retry all at the same time.
+
+    Parameters:
+        function: The client method to call (e.g. `cloudwatch.get_metric_data`).
+        max_attempts: The maximum number of calls before the throttling error is raised (default is 5).
+        max_delay: The upper bound of the delay between attempts in seconds (default is 20 seconds).
+        **kwargs: The arguments of the API call.
+
+    Returns:
+        The response of the API call.
+
+    Raises:
+        ClientError: If the call fails with another error, or is still throttled after `max_attempts` calls.
+    '''
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return function(**kwargs)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in THROTTLING_ERROR_CODES or attempt == max_attempts:
+                raise
+            delay = random.uniform(0, min(2 ** attempt, max_delay))
+            print(f"Request throttled, retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+
+
+# Lookup functions wrapped by `ttl_cache`, so that their caches can be cleared together
+_TTL_CACHED_FUNCTIONS = []
+
+
+def ttl_cache(ttl=300):
+    '''
+    This decorator caches the results of an AWS lookup (e.g. a describe call returning an ARN) for `ttl` seconds,
+    since ARNs stay the same for the lifetime of the deployment. Results equal to `None` (not found or error)
+    are not cached, so a missing resource is looked up again on the next call. The cache is thread-safe.
+
+    Parameters:
+        ttl: The number of seconds a result stays cached (default is 300 seconds).
+
+    Returns:
+        The decorator. The wrapped function gets a `cache_clear()` method.
+    '''
+
+    def decorator(function):
+        cache = {}
+        lock = threading.Lock()
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            # Keyword arguments are part of the key, in any order
+            key = (args, frozenset(kwargs.items()))
+            with lock:
+                entry = cache.get(key)
+            if entry is not None and time.monotonic() - entry[0] < ttl:
+                return entry[1]
+
+            result = function(*args, **kwargs)
+            if result is not None:
+                with lock:
+                    cache[key] = (time.monotonic(), result)
+            return result
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+
+        wrapper.cache_clear = cache_clear
+        _TTL_CACHED_FUNCTIONS.append(wrapper)
+        return wrapper
+
+    return decorator
+
+
+def refresh_lookup_caches():
+    '''
+    This function clears the cache of every lookup wrapped by `ttl_cache`, e.g. after the load balancer
+    or the target groups were deleted and created again.
+    '''
+    for function in _TTL_CACHED_FUNCTIONS:
+        function.cache_clear()
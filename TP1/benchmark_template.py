@@ -0,0 +1,103 @@
+# Standalone benchmarking script for the load balancer.
+# It is imported by benckmarking.py to run the benchmark locally, and it is also read as a
+# string.Template: the LOAD_BALANCER_URL placeholder below is substituted before the script
+# is uploaded to an EC2 instance and executed there.
+import asyncio
+import os
+import statistics
+import time
+import aiohttp
+
+
+# Function to send one request to the load balancer and record its outcome
+async def call_endpoint_http(session, semaphore, url, results):
+    '''
+    This function sends a single GET request to the load balancer and records its status code and latency.
+
+    Parameters:
+        session: The shared aiohttp ClientSession used to send the request.
+        semaphore: The asyncio Semaphore bounding the number of in-flight requests.
+        url: The URL to send the request to.
+        results: The list where a (status_code, latency) tuple, or (None, error) on failure, is appended.
+
+    Returns:
+        None.
+    '''
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            async with session.get(url) as response:
+                # Drain the body so the connection goes back to the pool
+                await response.read()
+                results.append((response.status, time.perf_counter() - start))
+        except Exception as e:
+            results.append((None, str(e)))
+
+
+# Function to benchmark the load balancer directly from this machine
+async def run_benchmark(load_balancer_url, num_requests=1000, concurrency=100):
+    '''
+    This function benchmarks the load balancer from the local machine, without going through an EC2 instance.
+
+    Steps:
+    1. The function accepts the load balancer URL, the number of requests, and the maximum number of in-flight requests.
+       If there is no request to send, it prints a message and returns right away.
+    2. A single aiohttp ClientSession with a pooled keep-alive connector is created for all the requests.
+    3. One task is created per request, and the function waits for all of them to complete.
+    4. The status codes, the number of failed requests, and the latency percentiles are printed once at the end,
+       along with the total and average time.
+
+    Parameters:
+        load_balancer_url: The URL of the load balancer to test (port 8000 is appended).
+        num_requests: The number of requests to send (default is 1000).
+        concurrency: The maximum number of requests in flight at the same time (default is 100).
+
+    Returns:
+        A list of (status_code, latency) tuples, with (None, error) for failed requests.
+    '''
+    # Nothing to wait for or average over
+    if num_requests <= 0:
+        print(f"No requests to send (num_requests={num_requests}).")
+        return []
+
+    url = f"{load_balancer_url}:8000"
+    results = []
+    start_time = time.time()
+
+    # Pooled keep-alive connections, reused across requests
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency, ttl_dns_cache=300, keepalive_timeout=60)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession(connector=connector, headers={'content-type': 'application/json'}) as session:
+        tasks = [asyncio.ensure_future(call_endpoint_http(session, semaphore, url, results)) for _ in range(num_requests)]
+        await asyncio.wait(tasks)
+
+    total_time = time.time() - start_time
+    average_time = total_time / num_requests
+
+    # Aggregate the results once, after every request has completed
+    latencies = [latency for status, latency in results if status is not None]
+    status_counts = {}
+    for status, _ in results:
+        status_counts[status] = status_counts.get(status, 0) + 1
+    failures = status_counts.pop(None, 0)
+
+    print(f"Status codes: {status_counts}, Failed requests: {failures}")
+    if len(latencies) >= 2:
+        percentiles = statistics.quantiles(latencies, n=100)
+        print(f"Latency p50: {percentiles[49]:.3f}s, p95: {percentiles[94]:.3f}s, p99: {percentiles[98]:.3f}s")
+    print(f"\nTotal time taken: {total_time:.2f} seconds")
+    print(f"Average time per request: {average_time:.2f} seconds")
+
+    return results
+
+
+if __name__ == "__main__":
+    # Use the libuv-based event loop when it is installed
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+
+    asyncio.run(run_benchmark("$LOAD_BALANCER_URL", num_requests=int(os.environ.get("BENCHMARK_NUM_REQUESTS", "1000"))))
@@ -1,13 +1,22 @@
-import boto3
-import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
+from aws_config import ttl_cache, call_with_backoff
 import os
+import sys
+import matplotlib
+# Without a display (e.g. over SSH), render with Agg directly instead of probing the GUI backends.
+# This must run before pyplot is imported anywhere, cloudwatch_loadbalancer imports this module first.
+if sys.platform.startswith('linux') and not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY')):
+    matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 
-# Initialize boto3 clients
-cloudwatch = boto3.client('cloudwatch', region_name='us-east-1')
-elb = boto3.client('elbv2', region_name='us-east-1')
+# Shared boto3 clients
+from aws_clients import cloudwatch, elbv2 as elb
 
 # Function to retrieve Target Group ARNs dynamically
+@ttl_cache(ttl=300)
 def get_target_group_arn(target_group_name):
     '''
     This function retrieves the Amazon Resource Name (ARN) of a target group by its name using AWS Elastic Load Balancing (ELB).
@@ -54,20 +63,23 @@ def get_target_group_arn(target_group_name):
 
 
 # Function to fetch EC2 instance IDs from a target group
-def get_instance_ids_from_target_group(target_group_arn):
+def get_instance_ids_from_target_group(target_group_arn, states=('healthy', 'initial', 'unavailable')):
     '''
     This function retrieves the EC2 instance IDs associated with a given target group in AWS Elastic Load Balancing (ELB).
+    Only the targets in one of the given health states are kept, so that no metrics are queried for
+    draining or unused instances whose CloudWatch data is stale or empty.
     
     Steps:
-    1. The function accepts the ARN of the target group as a parameter.
+    1. The function accepts the ARN of the target group and the accepted health states as parameters.
     2. It calls the `describe_target_health` method of the ELB client to fetch the health descriptions of the targets in the target group.
-    3. The EC2 instance IDs are extracted from the target health descriptions.
+    3. The EC2 instance IDs of the targets whose state is in `states` are extracted from the target health descriptions.
     4. If the target group contains instances, their IDs are printed and returned as a list.
     5. If an error occurs during the API call, the exception is caught and an error message is printed.
     6. If an error occurs, the function returns an empty list.
 
     Parameters:
         target_group_arn: The ARN of the target group from which to retrieve the instance IDs.
+        states: The target health states to keep (default is ('healthy', 'initial', 'unavailable')), or None to keep every target.
 
     Returns:
         A list of EC2 instance IDs associated with the target group. If an error occurs, an empty list is returned.
@@ -81,7 +93,8 @@ def get_instance_ids_from_target_group(target_group_arn):
         response = elb.describe_target_health(TargetGroupArn=target_group_arn)
 
         # Extract the EC2 instance IDs from the target health descriptions
-        instance_ids = [target['Target']['Id'] for target in response['TargetHealthDescriptions']]
+        instance_ids = [target['Target']['Id'] for target in response['TargetHealthDescriptions']
+                        if states is None or target.get('TargetHealth', {}).get('State') in states]
         print(f"EC2 Instance IDs from Target Group: {instance_ids}")
 
         # Return the list of instance IDs
@@ -93,63 +106,333 @@ def get_instance_ids_from_target_group(target_group_arn):
         return []
 
 
+# Function to retrieve the ARNs of several Target Groups in one request
+def get_target_group_arns(target_group_names):
+    '''
+    This function retrieves the ARNs of several target groups with a single `describe_target_groups` call,
+    filtered on their names, instead of one call per target group.
+
+    Steps:
+    1. The function accepts a list of target group names as a parameter.
+    2. It calls `describe_target_groups` once with all the names.
+    3. The ARN of every target group in the response is mapped to its name.
+    4. If the call fails (e.g. one of the names does not exist, which fails the whole request), the function
+       falls back to looking up each name with `get_target_group_arn`, leaving out the names that are not found.
+
+    Parameters:
+        target_group_names: The names of the target groups to retrieve the ARNs for.
+
+    Returns:
+        A dictionary mapping each target group name that was found to its ARN.
+    '''
+
+    try:
+        # Describe all the target groups by name in one request
+        response = elb.describe_target_groups(Names=list(target_group_names))
+        target_group_arns = {target_group['TargetGroupName']: target_group['TargetGroupArn'] for target_group in response['TargetGroups']}
+        print(f"Retrieved Target Group ARNs: {target_group_arns}")
+        return target_group_arns
+
+    # Fall back to one lookup per name if the batched request fails
+    except Exception as e:
+        print(f"Error retrieving target group ARNs, looking them up one by one: {e}")
+        target_group_arns = {name: get_target_group_arn(name) for name in target_group_names}
+        return {name: arn for name, arn in target_group_arns.items() if arn is not None}
+
+
+# Function to fetch the EC2 instance IDs of several target groups concurrently
+def get_instance_ids_per_target_group(target_group_names):
+    '''
+    This function retrieves the EC2 instance IDs of several target groups: their ARNs are retrieved in one request,
+    then the `describe_target_health` calls of every target group run concurrently instead of one after the other.
+
+    Steps:
+    1. The function accepts a list of target group names as a parameter.
+    2. The ARNs of all the target groups are retrieved with `get_target_group_arns`.
+    3. For each target group, a thread retrieves its instance IDs with `get_instance_ids_from_target_group`.
+       The shared ELB client is thread-safe.
+    4. Target groups whose ARN could not be retrieved are left out of the result.
+
+    Parameters:
+        target_group_names: The names of the target groups to retrieve the instance IDs for.
+
+    Returns:
+        A dictionary mapping each target group name to the list of its EC2 instance IDs, in the order of `target_group_names`.
+    '''
+
+    if not target_group_names:
+        return {}
+
+    # Dynamically get the Target Group ARNs, then the EC2 instance IDs registered in each of them
+    target_group_arns = get_target_group_arns(target_group_names)
+    found_names = [name for name in target_group_names if name in target_group_arns]
+    if not found_names:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=min(len(found_names), 16)) as executor:
+        results = list(executor.map(lambda name: get_instance_ids_from_target_group(target_group_arns[name]), found_names))
+
+    return dict(zip(found_names, results))
+
+
+# Time series of a CloudWatch metric
+@dataclass(frozen=True)
+class MetricSeries:
+    '''
+    This class holds the datapoints of a CloudWatch metric as two NumPy arrays (timestamps as `datetime64`, values
+    as `float64`) in chronological order, which matplotlib and vectorized NumPy operations use directly.
+    It can be unpacked like the former `(timestamps, values)` tuples, and is falsy when it holds no datapoint.
+
+    Attributes:
+        timestamps: The UTC timestamps of the datapoints.
+        values: The values of the datapoints.
+    '''
+    timestamps: np.ndarray
+    values: np.ndarray
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __bool__(self):
+        return len(self.timestamps) > 0
+
+    def __iter__(self):
+        return iter((self.timestamps, self.values))
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype='datetime64[ns]'), np.empty(0, dtype=np.float64))
+
+    @classmethod
+    def from_lists(cls, timestamps, values):
+        # CloudWatch timestamps are in UTC, the timezone is dropped because datetime64 has none
+        return cls(np.array([timestamp.replace(tzinfo=None) for timestamp in timestamps], dtype='datetime64[ns]'),
+                   np.asarray(values, dtype=np.float64))
+
+
+# Function to sort CloudWatch datapoints chronologically
+def sort_datapoints(datapoints, statistic):
+    '''
+    This function converts the datapoints returned by `get_metric_statistics` into NumPy arrays and sorts them
+    by timestamp with `argsort`, so that the sort runs in native code instead of over Python tuples.
+
+    Steps:
+    1. The timestamps (UTC) are collected into a `datetime64` array and the values into a `float64` array.
+    2. A stable `argsort` of the timestamps gives the chronological order.
+    3. Both arrays are reordered with that index and returned.
+
+    Parameters:
+        datapoints: The `Datapoints` list of a `get_metric_statistics` response.
+        statistic: The statistic to read from each datapoint (e.g., 'Average' or 'Sum').
+
+    Returns:
+        A MetricSeries holding the sorted timestamps and the corresponding values.
+    '''
+
+    # CloudWatch timestamps are in UTC, the timezone is dropped because datetime64 has none
+    timestamps = np.fromiter((datapoint['Timestamp'].replace(tzinfo=None) for datapoint in datapoints),
+                             dtype='datetime64[ns]', count=len(datapoints))
+    values = np.fromiter((datapoint[statistic] for datapoint in datapoints), dtype=np.float64, count=len(datapoints))
+
+    # Sort the timestamps and values for chronological order
+    order = np.argsort(timestamps, kind='stable')
+    return MetricSeries(timestamps[order], values[order])
+
+
+# Function to average the metric series of several EC2 instances
+def average_series(series_list):
+    '''
+    This function averages the metric series of several EC2 instances timestamp by timestamp, with NumPy
+    element-wise operations instead of Python list comprehensions.
+
+    Steps:
+    1. The timestamps of every non-empty series are merged into one sorted array of unique timestamps.
+    2. The values of each series are placed at the index of their timestamps in a `float64` matrix filled with NaN,
+       so an instance missing a datapoint leaves a NaN instead of being dropped.
+    3. The values and the number of datapoints are summed per timestamp, ignoring the NaN entries.
+    4. The sums are divided by the counts, so each timestamp is averaged over the instances that reported it.
+
+    Parameters:
+        series_list: The MetricSeries of each instance.
+
+    Returns:
+        A MetricSeries holding the merged timestamps and the average value at each of them,
+        or an empty MetricSeries if no series has any datapoint.
+    '''
+
+    series_list = [series for series in series_list if series]
+    if not series_list:
+        return MetricSeries.empty()
+
+    # Merge the timestamps of every instance
+    timestamps = np.unique(np.concatenate([series.timestamps for series in series_list]))
+
+    # Place each instance's values on the merged timestamps, NaN where the instance has no datapoint
+    matrix = np.full((len(series_list), len(timestamps)), np.nan)
+    for row, series in zip(matrix, series_list):
+        row[np.searchsorted(timestamps, series.timestamps)] = series.values
+
+    # Average the available values at each timestamp
+    # (every merged timestamp is reported by at least one instance, so no count is zero)
+    counts = np.count_nonzero(~np.isnan(matrix), axis=0)
+    return MetricSeries(timestamps, np.nansum(matrix, axis=0) / counts)
+
+
 # Function to fetch CPU utilization or network metric for EC2 instances
-def get_ec2_metrics(instance_id, metric_name):
+def get_ec2_metrics(instance_id, metric_name, statistic='Average', start_time=None, end_time=None, period=300):
     '''
-    This function retrieves CloudWatch metrics for a specified EC2 instance over the past hour.
-    It fetches the average of the specified metric in 5-minute intervals and returns the timestamps 
-    and values for the metric.
+    This function retrieves CloudWatch metrics for a specified EC2 instance over the past hour, or over the
+    window given by `start_time` and `end_time` (a shorter window returns fewer datapoints).
+    It fetches a single statistic (the average by default) of the specified metric in 5-minute intervals
+    and returns the timestamps and values for the metric. Only the plotted statistic is requested, since
+    each additional statistic is retrieved and billed separately.
 
     Steps:
     1. The function accepts the EC2 instance ID and the metric name as parameters.
     2. It calls the `get_metric_statistics` method from AWS CloudWatch to fetch the metric data 
        for the specified instance and time period.
-    3. The metric is averaged over 5-minute intervals for the past 1 hour.
+    3. The metric is aggregated with `statistic` over 5-minute intervals for the past 1 hour.
     4. The function extracts the timestamps and corresponding metric values from the response.
-    5. The data is sorted by timestamp to ensure chronological order.
-    6. The function returns two lists: one for the timestamps and one for the metric values.
+    5. The data is sorted by timestamp to ensure chronological order, using `sort_datapoints`.
+    6. The function returns a MetricSeries with the timestamps and the metric values.
     7. If an error occurs during the API call, the exception is caught, an error message is printed,
-       and two empty lists are returned.
+       and an empty MetricSeries is returned.
 
     Parameters:
         instance_id: The ID of the EC2 instance to retrieve the metrics for.
         metric_name: The name of the CloudWatch metric to fetch (e.g., 'CPUUtilization').
+        statistic: The statistic to fetch (e.g., 'Average', 'Maximum', 'Sum'; default is 'Average').
+        start_time: Start of the window as a timezone-aware datetime (default is None, i.e. 1 hour before `end_time`).
+        end_time: End of the window as a timezone-aware datetime (default is None, i.e. now).
+        period: The granularity of the datapoints in seconds (default is 300, i.e. 5-minute intervals).
 
     Returns:
-        Two lists: one for timestamps and one for metric values. If an error occurs, empty lists are returned.
+        A MetricSeries with the timestamps and the metric values. If an error occurs, an empty MetricSeries is returned.
 
     Raises:
         Exception: Any errors during the API call are caught and handled.
     '''
 
+    # Default to the last hour
+    end_time = end_time or datetime.now(timezone.utc)
+    start_time = start_time or end_time - timedelta(hours=1)
+
     try:
         # Fetch metrics for the EC2 instance from CloudWatch
-        response = cloudwatch.get_metric_statistics(
+        response = call_with_backoff(
+            cloudwatch.get_metric_statistics,
             Namespace='AWS/EC2',  # Specify the EC2 namespace for metrics
             MetricName=metric_name,  # The name of the metric to retrieve
             Dimensions=[{'Name': 'InstanceId', 'Value': instance_id}],  # Filter by EC2 instance ID
-            StartTime=datetime.utcnow() - timedelta(hours=1),  # Last 1 hour
-            EndTime=datetime.utcnow(),  # Current time
-            Period=300,  # 5-minute intervals
-            Statistics=['Average']  # Fetch the average of the metric over the period
+            StartTime=start_time,  # Last 1 hour by default
+            EndTime=end_time,  # Current time by default
+            Period=period,  # 5-minute intervals by default
+            Statistics=[statistic]  # Fetch only the statistic that is plotted
         )
 
-        # Extract timestamps and values from the response
-        timestamps = [datapoint['Timestamp'] for datapoint in response['Datapoints']]
-        values = [datapoint['Average'] for datapoint in response['Datapoints']]
+        # Return the timestamps and values from the response, in chronological order
+        return sort_datapoints(response['Datapoints'], statistic)
 
-        # Sort the timestamps and values for chronological order
-        if timestamps and values:
-            sorted_data = sorted(zip(timestamps, values), key=lambda x: x[0])
-            timestamps, values = zip(*sorted_data)
+    # Handle any exceptions during the API call
+    except Exception as e:
+        print(f"Error retrieving metrics for {instance_id}: {e}")
+        return MetricSeries.empty()
+
+
+# Function to fetch several metrics for several EC2 instances in batched requests
+def get_ec2_metrics_batch(instance_ids, metric_names, statistic='Average', start_time=None, end_time=None, period=300):
+    '''
+    This function retrieves CloudWatch metrics for several EC2 instances over the past hour (or over the window
+    given by `start_time` and `end_time`) using the
+    `get_metric_data` API, which accepts up to 500 metric queries per request, instead of issuing one
+    `get_metric_statistics` call per instance and metric.
+
+    Steps:
+    1. The function accepts a list of EC2 instance IDs and a list of metric names as parameters.
+    2. One metric query (`statistic` over 5-minute intervals, the average by default) is built for every (instance, metric) pair.
+    3. The queries are sent in chunks of 500 with `get_metric_data`, following `NextToken` pagination.
+    4. The results are returned in ascending timestamp order and mapped back to their (instance, metric) pair.
+    5. If an error occurs during the API call, the exception is caught, an error message is printed,
+       and the pairs that were not retrieved map to an empty MetricSeries.
+
+    Parameters:
+        instance_ids: The IDs of the EC2 instances to retrieve the metrics for.
+        metric_names: The names of the CloudWatch metrics to fetch (e.g., ['CPUUtilization', 'NetworkIn']).
+        statistic: The single statistic to fetch for every pair (default is 'Average').
+        start_time: Start of the window as a timezone-aware datetime (default is None, i.e. 1 hour before `end_time`).
+        end_time: End of the window as a timezone-aware datetime (default is None, i.e. now).
+        period: The granularity of the datapoints in seconds (default is 300, i.e. 5-minute intervals).
+
+    Returns:
+        A dictionary mapping each (instance_id, metric_name) tuple to a MetricSeries.
+
+    Raises:
+        Exception: Any errors during the API call are caught and handled.
+    '''
 
-        # Return the sorted timestamps and values
-        return timestamps, values
+    # Build one query per (instance, metric) pair, with an ID that maps the result back to its pair
+    queries = {}
+    for i, instance_id in enumerate(instance_ids):
+        for j, metric_name in enumerate(metric_names):
+            queries[f'm{i}_{j}'] = (instance_id, metric_name)
+
+    metric_data_queries = [{
+        'Id': query_id,
+        'MetricStat': {
+            'Metric': {
+                'Namespace': 'AWS/EC2',  # Specify the EC2 namespace for metrics
+                'MetricName': metric_name,  # The name of the metric to retrieve
+                'Dimensions': [{'Name': 'InstanceId', 'Value': instance_id}]  # Filter by EC2 instance ID
+            },
+            'Period': period,  # 5-minute intervals by default
+            'Stat': statistic  # Fetch only the statistic that is plotted
+        }
+    } for query_id, (instance_id, metric_name) in queries.items()]
+
+    # Every pair starts empty, so missing or failed results still map to empty lists
+    results = {pair: ([], []) for pair in queries.values()}
+    end_time = end_time or datetime.now(timezone.utc)
+    start_time = start_time or end_time - timedelta(hours=1)  # Last 1 hour by default
+
+    try:
+        # GetMetricData accepts at most 500 queries per request
+        for offset in range(0, len(metric_data_queries), 500):
+            kwargs = {
+                'MetricDataQueries': metric_data_queries[offset:offset + 500],
+                'StartTime': start_time,
+                'EndTime': end_time,
+                'ScanBy': 'TimestampAscending'  # Chronological order
+            }
+            while True:
+                response = call_with_backoff(cloudwatch.get_metric_data, **kwargs)
+
+                # Append the datapoints of each query to its (instance, metric) pair
+                for result in response['MetricDataResults']:
+                    timestamps, values = results[queries[result['Id']]]
+                    timestamps.extend(result['Timestamps'])
+                    values.extend(result['Values'])
+
+                if 'NextToken' not in response:
+                    break
+                kwargs['NextToken'] = response['NextToken']
 
     # Handle any exceptions during the API call
     except Exception as e:
-        print(f"Error retrieving metrics for {instance_id}: {e}")
-        return [], []
+        print(f"Error retrieving metrics for {instance_ids}: {e}")
+
+    # Return the timestamps and values of each (instance, metric) pair
+    return {pair: MetricSeries.from_lists(timestamps, values) for pair, (timestamps, values) in results.items()}
+
+
+# Function to display the current plot and release it
+def show_plot():
+    '''
+    This function displays the current figure when an interactive backend is available, then closes it so that
+    repeated plots do not keep every figure in memory. With the Agg backend there is nothing to display.
+    '''
+    if matplotlib.get_backend().lower() != 'agg':
+        plt.show()
+    plt.close()
 
 
 # Function to plot metrics for comparison between two target groups
@@ -166,11 +449,11 @@ def plot_comparison_metrics(aggregated_data, metric_name):
     4. The plot includes a title, labels, and a legend to differentiate the target groups.
     5. The x-axis labels are rotated for better readability, and the layout is adjusted for clarity.
     6. The plot is saved as a PNG file in the 'images' directory with the metric name in the filename.
-    7. The plot is then displayed using `plt.show()`.
+    7. The plot is then displayed with `show_plot()` (when a display is available) and closed.
 
     Parameters:
-        aggregated_data: A dictionary where the keys are target group names and the values are tuples containing
-                         timestamps and corresponding metric values for each target group.
+        aggregated_data: A dictionary where the keys are target group names and the values are MetricSeries (or
+                         (timestamps, values) tuples) holding the metric data of each target group.
         metric_name: The name of the metric being plotted (e.g., 'CPUUtilization').
 
     Returns:
@@ -217,7 +500,7 @@ def plot_comparison_metrics(aggregated_data, metric_name):
     plot_file_path = os.path.join(image_dir, f'{metric_name}_comparison.png')
     plt.savefig(plot_file_path)
 
-    # Display the plot on the screen
-    plt.show()
+    # Display the plot on the screen, then release the figure
+    show_plot()
 
     print(f"Plot saved at {plot_file_path}")
@@ -1,24 +1,31 @@
-import boto3
+from aws_config import ttl_cache, call_with_backoff
+from cloudwatch import MetricSeries, sort_datapoints, show_plot
 import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import os
+import functools
+import logging
+import time
+import numpy as np
 
-# Initialize boto3 clients
-cloudwatch = boto3.client('cloudwatch', region_name='us-east-1')
-elb = boto3.client('elbv2', region_name='us-east-1')
+# Shared boto3 clients
+from aws_clients import cloudwatch, elbv2 as elb
+
+# The per-datapoint details are logged at DEBUG level, enable them with logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
 
 # Function to extract the resource part of the ARN (app/my-load-balancer/...)
+@functools.lru_cache(maxsize=128)
 def extract_lb_resource_from_arn(full_arn):
     """
     This function extracts the resource portion (e.g., 'app/my-load-balancer/...') from a full Amazon Resource Name (ARN)
-    for a load balancer. The function assumes that the ARN is split by '/' and returns the second, third, and fourth 
-    parts of the ARN, joined by slashes.
+    for a load balancer, i.e. everything after ':loadbalancer/'. The results are cached since the same ARN is
+    extracted repeatedly.
 
     Steps:
     1. The function accepts the full ARN as a parameter.
-    2. It splits the ARN by '/' to break it into its components.
-    3. If the ARN contains at least four components (to ensure it has the expected structure), 
-       it extracts and returns the resource part as 'arn_part2/arn_part3/arn_part4'.
+    2. It partitions the ARN on ':loadbalancer/' in a single pass, without splitting it into a list.
+    3. If the separator is found and followed by the resource part, the resource part ('app/name/id') is returned.
     4. If the ARN does not meet the expected structure, a ValueError is raised with a message indicating
        that the ARN format is invalid.
 
@@ -29,30 +36,32 @@ def extract_lb_resource_from_arn(full_arn):
         A string containing the resource part of the ARN (e.g., 'app/my-load-balancer/...').
 
     Raises:
-        ValueError: If the ARN does not have the expected format with at least 3 components.
+        ValueError: If the ARN does not contain a ':loadbalancer/' resource part.
     """
 
-    # Split the full ARN by '/' to get its components
-    arn_parts = full_arn.split('/')
+    # Keep everything after the resource type of the ARN
+    resource = full_arn.partition(':loadbalancer/')[2]
 
-    # Ensure that the ARN has at least 4 parts (minimum required structure)
-    if len(arn_parts) >= 3:
-        # Return the resource part of the ARN (second, third, and fourth parts)
-        return f"{arn_parts[1]}/{arn_parts[2]}/{arn_parts[3]}"
+    if resource:
+        # Return the resource part of the ARN (type, name and ID)
+        return resource
     else:
         # Raise an error if the ARN format is invalid
         raise ValueError("Invalid ARN format")
 
 
 # Function to dynamically retrieve the Load Balancer ARN
-def get_load_balancer_arn():
+@ttl_cache(ttl=300)
+def get_load_balancer_arn(load_balancer_name=None):
     """
-    This function retrieves the Amazon Resource Name (ARN) of the first available load balancer
-    from AWS Elastic Load Balancing (ELB). It extracts the resource portion of the ARN using the 
-    `extract_lb_resource_from_arn` function.
+    This function retrieves the Amazon Resource Name (ARN) of the load balancer named `load_balancer_name`,
+    or of the first available load balancer if no name is given, from AWS Elastic Load Balancing (ELB).
+    It extracts the resource portion of the ARN using the `extract_lb_resource_from_arn` function.
+    The lookup is filtered on the server side, so its cost does not grow with the number of load balancers.
 
     Steps:
-    1. The function calls the `describe_load_balancers` method to retrieve all load balancers.
+    1. The function calls the `describe_load_balancers` method filtered on the name, or limited to a single
+       result when no name is given.
     2. It checks if there are any load balancers in the response.
     3. If load balancers are present, it extracts the full ARN of the first load balancer.
     4. The resource portion of the ARN is extracted using the `extract_lb_resource_from_arn` function.
@@ -60,6 +69,9 @@ def get_load_balancer_arn():
     6. If an error occurs during the API call, it catches the exception, prints the error message, 
        and returns `None`.
 
+    Parameters:
+        load_balancer_name: The name of the load balancer to retrieve (default is None, i.e. the first load balancer).
+
     Returns:
         The resource portion of the load balancer ARN (e.g., 'app/my-load-balancer/...') if successful.
         If no load balancers are found or if an error occurs, the function returns `None`.
@@ -69,8 +81,11 @@ def get_load_balancer_arn():
     """
 
     try:
-        # Retrieve the list of load balancers from AWS
-        response = elb.describe_load_balancers()
+        # Retrieve only the requested load balancer (or the first one) from AWS
+        if load_balancer_name:
+            response = elb.describe_load_balancers(Names=[load_balancer_name])
+        else:
+            response = elb.describe_load_balancers(PageSize=1)
 
         # Check if there are load balancers in the response
         if 'LoadBalancers' in response and len(response['LoadBalancers']) > 0:
@@ -92,28 +107,36 @@ def get_load_balancer_arn():
 
 
 # Function to fetch RequestCount metric data for the load balancer
-def get_load_balancer_request_count(lb_arn):
+def get_load_balancer_request_count(lb_arn, statistic='Sum', start_time=None, end_time=None, period=300):
     """
     This function retrieves the request count for a specified Application Load Balancer (ALB) 
-    from AWS CloudWatch over the last 24 hours. The function fetches the `RequestCount` metric 
+    from AWS CloudWatch over the last 24 hours, or over the window given by `start_time` and `end_time`
+    (a shorter window returns fewer datapoints). The function fetches the `RequestCount` metric 
     in 5-minute intervals and returns the timestamps and request count values.
 
     Steps:
     1. The function accepts the ARN of the load balancer as a parameter.
-    2. It checks if the `lb_arn` is provided. If not, it prints a message and returns empty lists.
+    2. It checks if the `lb_arn` is provided. If not, it prints a message and returns an empty MetricSeries.
     3. The function calls `get_metric_statistics` from AWS CloudWatch to fetch the `RequestCount` metric
        for the load balancer over the last 24 hours.
     4. It extracts the timestamps and request count values from the response.
-    5. If no data is available, a message is printed. Otherwise, the data is sorted by timestamp and printed.
-    6. Finally, the function returns two lists: one for the timestamps and one for the request count values.
-    7. If an error occurs during the API call, the exception is caught, an error message is printed, and empty lists are returned.
+    5. The data is sorted by timestamp with `sort_datapoints`. If no data is available, a message is printed, otherwise
+       a one-line summary is printed and every datapoint is logged at DEBUG level.
+    6. Finally, the function returns two arrays: one for the timestamps and one for the request count values.
+    7. If an error occurs during the API call, the exception is caught, an error message is printed, and an empty MetricSeries is returned.
 
     Parameters:
         lb_arn: The ARN of the load balancer to retrieve the request count for.
+        statistic: The single statistic to fetch (default is 'Sum', the number of requests per interval).
+        start_time: Start of the window as a timezone-aware datetime (default is None, i.e. 24 hours before `end_time`).
+        end_time: End of the window as a timezone-aware datetime (default is None, i.e. now).
+        period: The granularity of the datapoints in seconds (default is 300, i.e. 5-minute intervals).
+        settle_time: How long (in seconds) the total must stay unchanged to be considered complete
+                     (default is 60 seconds, the ALB publishing interval).
 
     Returns:
-        Two lists: one for the timestamps and one for the request count values. If no data is available 
-        or an error occurs, empty lists are returned.
+        A MetricSeries with the timestamps and the request count values (it can be unpacked as `timestamps, values`).
+        If no data is available or an error occurs, the MetricSeries is empty.
 
     Raises:
         Exception: Any errors during the API call are caught and handled.
@@ -122,44 +145,101 @@ def get_load_balancer_request_count(lb_arn):
     # Check if the load balancer ARN is provided
     if not lb_arn:
         print("Load Balancer ARN is missing.")
-        return [], []
+        return MetricSeries.empty()
+
+    # Default to the last 24 hours
+    end_time = end_time or datetime.now(timezone.utc)
+    start_time = start_time or end_time - timedelta(hours=24)
 
     try:
-        # Fetch the RequestCount metric for the load balancer from CloudWatch over the last 24 hours
-        response = cloudwatch.get_metric_statistics(
+        # Fetch the RequestCount metric for the load balancer from CloudWatch over the window
+        response = call_with_backoff(
+            cloudwatch.get_metric_statistics,
             Namespace='AWS/ApplicationELB',  # Namespace for ALB metrics
             MetricName='RequestCount',  # Metric to retrieve (RequestCount)
             Dimensions=[{'Name': 'LoadBalancer', 'Value': lb_arn}],  # Filter by load balancer ARN
-            StartTime=datetime.utcnow() - timedelta(hours=24),  # Last 24 hours
-            EndTime=datetime.utcnow(),  # Current time
-            Period=300,  # 5-minute intervals
-            Statistics=['Sum']  # Sum the request counts over each interval
+            StartTime=start_time,  # Last 24 hours by default
+            EndTime=end_time,  # Current time by default
+            Period=period,  # 5-minute intervals by default
+            Statistics=[statistic]  # Fetch only the statistic that is plotted
         )
 
-        # Extract timestamps and request count values from the response
-        timestamps = [datapoint['Timestamp'] for datapoint in response['Datapoints']]
-        values = [datapoint['Sum'] for datapoint in response['Datapoints']]
+        # Extract timestamps and request count values from the response, sorted by timestamp
+        series = sort_datapoints(response['Datapoints'], statistic)
 
         # If no data is available, print a message
-        if not timestamps or not values:
+        if not series:
             print("No data available.")
         else:
-            # Sort the data by timestamp for chronological ordering
-            sorted_data = sorted(zip(timestamps, values), key=lambda x: x[0])
-            timestamps, values = zip(*sorted_data)
-
-            # Print out the number of requests at each timestamp
-            print("\nRequest Count Data:")
-            for time, value in zip(timestamps, values):
-                print(f"Time: {time}, Request Count: {value}")
+            # Summarize the data, the number of requests at each timestamp is only logged at DEBUG level
+            print(f"Retrieved {len(series)} Request Count datapoints ({series.values.sum():.0f} requests in total).")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Request Count Data: %s", list(zip(series.timestamps.tolist(), series.values.tolist())))
 
         # Return the timestamps and values
-        return timestamps, values
+        return series
 
     # Handle any exceptions during the API call
     except Exception as e:
         print(f"Error retrieving metrics: {e}")
-        return [], []
+        return MetricSeries.empty()
+
+
+# Function to wait until CloudWatch has the RequestCount of the load balancer since a given time
+def wait_for_load_balancer_request_count(lb_arn, until, max_wait=300, interval=15, period=300, settle_time=60):
+    """
+    This function polls the `RequestCount` metric of the load balancer until CloudWatch has the complete count of the
+    requests sent up to `until` (e.g. the end of the benchmark), instead of sleeping for a fixed 5 minutes.
+    ALB metrics usually land within one or two minutes, so the wait is often much shorter than `max_wait`.
+
+    Steps:
+    1. The function fetches the RequestCount with `get_load_balancer_request_count`.
+    2. It checks that the latest datapoint's interval covers `until`, i.e. CloudWatch has data up to the end of the benchmark.
+    3. Because CloudWatch publishes an interval while it is still filling, the function also checks that the total
+       request count has not changed for at least `settle_time` seconds, so the late requests are included.
+       ALB publishes once a minute, so two polls closer than that can see the same partial total.
+    4. If both checks pass, the series is returned. Otherwise, it waits `interval` seconds and polls again,
+       until `max_wait` seconds have elapsed.
+    5. When the deadline is reached, the last fetched series is returned (it may be empty or incomplete).
+
+    Parameters:
+        lb_arn: The ARN of the load balancer to retrieve the request count for.
+        until: A timezone-aware datetime up to which requests are expected (e.g. the end of the benchmark).
+        max_wait: The maximum total time (in seconds) to wait for the data (default is 300 seconds).
+        interval: The delay (in seconds) between two polls (default is 15 seconds).
+        period: The granularity of the datapoints in seconds (default is 300, i.e. 5-minute intervals).
+        settle_time: How long (in seconds) the total must stay unchanged to be considered complete
+                     (default is 60 seconds, the ALB publishing interval).
+
+    Returns:
+        The MetricSeries returned by the last `get_load_balancer_request_count` call.
+    """
+
+    # CloudWatch timestamps are naive UTC datetime64 values, the interval of a datapoint starts at its timestamp
+    until = np.datetime64(until.astimezone(timezone.utc).replace(tzinfo=None), 'ns')
+    deadline = time.monotonic() + max_wait
+    previous_total = None
+    stable_since = None
+
+    while True:
+        series = get_load_balancer_request_count(lb_arn, period=period)
+
+        # Stop once a datapoint covers `until` and the total count has not changed for `settle_time` seconds
+        if series and series.timestamps[-1] + np.timedelta64(period, 's') > until:
+            total = series.values.sum()
+            if total != previous_total:
+                previous_total = total
+                stable_since = time.monotonic()
+            elif time.monotonic() - stable_since >= settle_time:
+                return series
+
+        # Give up once the time budget is exhausted, returning what is available
+        if time.monotonic() + interval > deadline:
+            print(f"Complete Request Count data up to {until} is not available after {max_wait} seconds.")
+            return series
+
+        print(f"Request Count data is not complete yet, retrying in {interval} seconds...")
+        time.sleep(interval)
 
 
 # Function to plot the RequestCount over time and save it to a directory
@@ -176,7 +256,7 @@ def plot_metrics(timestamps, values, directory="images"):
     4. It then generates a line plot of the request counts over time.
     5. The plot includes labeled axes, a title, and a legend. The x-axis labels are rotated for readability.
     6. The plot is saved as a PNG file in the specified directory, and the file path is printed.
-    7. Finally, the plot is displayed using `plt.show()`.
+    7. Finally, the plot is displayed with `show_plot()` (when a display is available) and closed.
 
     Parameters:
         timestamps: A list of timestamps for the RequestCount metric.
@@ -191,7 +271,7 @@ def plot_metrics(timestamps, values, directory="images"):
     """
 
     # Check if there is data to plot
-    if not timestamps or not values:
+    if len(timestamps) == 0 or len(values) == 0:
         print("No data to plot.")
         return
     
@@ -212,7 +292,7 @@ def plot_metrics(timestamps, values, directory="images"):
     # Save the plot as a PNG file in the specified directory
     file_path = os.path.join(directory, 'request_count_plot.png')
     plt.savefig(file_path)  # Save the plot as a file
-    plt.show()  # Display the plot
+    show_plot()  # Display the plot, then release the figure
 
     # Print the file path where the plot is saved
     print(f"Plot saved to {file_path}")
@@ -6,6 +6,12 @@ import stat
 
 import time
 
+#for baking the FastAPI image
+from deploy_fastAPI import wait_for_ssh,ssh_exec_command,FASTAPI_INSTALL_COMMAND
+
+# Maximum number of instance IDs accepted by a single DescribeInstances call
+DESCRIBE_INSTANCES_BATCH_SIZE = 500
+
 
 #Create key pairs
 def create_key_pair(ec2, key_name, key_file):
@@ -54,7 +60,7 @@ def create_key_pair(ec2, key_name, key_file):
             raise e
 
 #create instance
-def create_instances(ec2, ami_id, key_name, subnet_id, security_group_id, instance_type, num_instances):
+def create_instances(ec2, ami_id, key_name, subnet_id, security_group_id, instance_type, num_instances, user_data=None):
     '''
     This function launches a specified number of EC2 instances with the provided parameters.
     It uses AWS Boto3 to run instances and waits until the instances are in the 'running' state.
@@ -64,8 +70,8 @@ def create_instances(ec2, ami_id, key_name, subnet_id, security_group_id, instan
        security group ID, instance type, and the number of instances to launch.
     2. It uses the `run_instances` method to launch the EC2 instances with the provided configuration.
     3. The instances are tagged with a name that includes the instance type.
-    4. It enables monitoring for the instances.
-    5. The function then waits for the instances to reach the 'running' state using a waiter.
+    4. It enables monitoring for the instances, and passes the optional UserData boot script.
+    5. The function then waits for the instances to reach the 'running' state using a waiter polling every 3 seconds.
     6. Finally, the function returns the list of instance IDs for the created instances.
 
     Parameters:
@@ -76,11 +82,15 @@ def create_instances(ec2, ami_id, key_name, subnet_id, security_group_id, instan
         security_group_id: The security group ID to assign to the instances.
         instance_type: The type of instance to launch (e.g., t2.micro).
         num_instances: The number of instances to launch.
+        user_data: An optional cloud-init script run by each instance at boot (default is None).
 
     Returns:
         A list of instance IDs for the instances that were launched.
     '''
 
+    # Pass the boot script only when one is given
+    extra_args = {'UserData': user_data} if user_data else {}
+
     # Launch EC2 instances with the specified parameters
     response = ec2.run_instances(
         ImageId=ami_id,
@@ -98,106 +108,155 @@ def create_instances(ec2, ami_id, key_name, subnet_id, security_group_id, instan
         # Enable detailed monitoring for the instances
         Monitoring={
             'Enabled': True
-        }
+        },
+        **extra_args
     )
     
     # Collect the instance IDs from the response
     instance_ids = [instance['InstanceId'] for instance in response['Instances']]
     print(f"Created instances: {instance_ids}")
     
-    # Wait for the instances to reach the 'running' state
+    # Wait for the instances to reach the 'running' state, polling every 3 seconds (instead of 15) for up to 10 minutes
     print("Waiting for instances to reach the 'running' state...")
-    ec2.get_waiter('instance_running').wait(InstanceIds=instance_ids)
+    ec2.get_waiter('instance_running').wait(InstanceIds=instance_ids, WaiterConfig={'Delay': 3, 'MaxAttempts': 200})
     print(f"Instances are now running: {instance_ids}")
 
     # Return the list of instance IDs
     return instance_ids
 
 
-def get_public_ids(ec2, instance_ids):
+def get_public_ids(ec2, instance_ids, max_wait=100, initial_delay=0.5, max_delay=15):
     '''
     This function retrieves the public IP addresses of EC2 instances by their instance IDs.
-    It waits for each instance to have a public IP and appends the public IPs to a list.
+    All instances are described in a single batched call per attempt, and the function waits
+    until every instance has a public IP, polling with an exponential backoff.
 
     Steps:
-    1. The function accepts two parameters: an EC2 client object and a list of instance IDs.
-    2. It iterates over each instance ID, waiting for the instance to obtain a public IP.
-    3. The `wait_for_public_ip` function is called to wait for the public IP assignment.
-    4. Once the public IP is available, it is printed and added to the list of public IPs.
-    5. Finally, the function returns a list of public IP addresses for the given instances.
+    1. The function accepts an EC2 client object, a list of instance IDs, and optional backoff settings.
+    2. It calls `describe_instances` once with all instance IDs (in slices of 500, the API limit) to fetch their details.
+    3. The 'PublicIpAddress' of each instance is collected into a mapping keyed by instance ID.
+    4. If every instance has a public IP, the IPs are printed and returned in the same order as `instance_ids`.
+    5. Otherwise, the function waits before retrying, doubling the delay each time up to `max_delay`.
+    6. If `max_wait` seconds elapse before all public IPs are assigned, the function raises an exception.
 
     Parameters:
         ec2: A Boto3 EC2 client object to interact with AWS EC2 service.
         instance_ids: A list of EC2 instance IDs for which to fetch public IP addresses.
+        max_wait: The maximum total time (in seconds) to wait for the public IPs (default is 100 seconds).
+        initial_delay: The delay (in seconds) before the first retry (default is 0.5 seconds).
+        max_delay: The maximum delay (in seconds) between two retries (default is 15 seconds).
 
     Returns:
         A list of public IP addresses for the specified EC2 instances.
+
+    Raises:
+        TimeoutError: If some public IPs are not retrieved within `max_wait` seconds.
     '''
 
-    # Initialize an empty list to store public IPs
-    public_ips = []
-    
-    # Iterate over the list of instance IDs
-    for instance_id in instance_ids:
-        # Wait for the instance to obtain a public IP
-        public_ip = wait_for_public_ip(ec2, instance_id)
-        
-        # Print the public IP of the instance
-        print("IP address is", public_ip)
-        
-        # Append the public IP to the list
-        public_ips.append(public_ip)
-    
-    # Return the list of public IPs
-    return public_ips
+    delay = initial_delay
+    deadline = time.monotonic() + max_wait
+
+    while True:
+        # Describe the instances in as few calls as possible (up to 500 IDs per call)
+        ips_by_id = {}
+        for start in range(0, len(instance_ids), DESCRIBE_INSTANCES_BATCH_SIZE):
+            response = ec2.describe_instances(InstanceIds=instance_ids[start:start + DESCRIBE_INSTANCES_BATCH_SIZE])
+
+            # Map each instance ID to its public IP address (if already assigned)
+            ips_by_id.update({
+                instance['InstanceId']: instance.get('PublicIpAddress')
+                for reservation in response['Reservations']
+                for instance in reservation['Instances']
+            })
+        public_ips = [ips_by_id.get(instance_id) for instance_id in instance_ids]
+
+        # If every instance has a public IP, return them
+        if all(public_ips):
+            for public_ip in public_ips:
+                print("IP address is", public_ip)
+            return public_ips
 
+        # Stop once the time budget is exhausted
+        if time.monotonic() + delay > deadline:
+            break
+
+        # Wait before the next retry, doubling the delay up to the cap
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+    # Raise an exception if some public IPs are not retrieved in time
+    missing = [instance_id for instance_id, public_ip in zip(instance_ids, public_ips) if not public_ip]
+    raise TimeoutError(f"Public IP for instances {missing} could not be retrieved.")
 
 
-# Function to wait for public IP
-def wait_for_public_ip(ec2, instance_id, retries=10, delay=10):
+#create (or reuse) an AMI with FastAPI pre-installed
+def create_fastapi_image(ec2, ami_id, key_name, key_file, subnet_id, security_group_id, image_name='fastapi-base'):
     '''
-    This function waits for an EC2 instance to obtain a public IP address by periodically checking
-    the instance's public IP over a specified number of retries. If the public IP is not available
-    after the given number of retries, the function raises an exception.
+    This function returns the ID of an AMI that already contains the FastAPI virtual environment
+    (fastapi, uvicorn, aiohttp and uvloop), so that deployments skip the apt/pip installs on every instance.
+    The image is baked once and reused by name on later runs.
 
     Steps:
-    1. The function accepts three parameters: an EC2 client object, the instance ID, 
-       and optional parameters for retries and delay between retries.
-    2. It loops over a specified number of retries to check if the instance has a public IP.
-    3. The `describe_instances` method is used to retrieve the instance details, 
-       and it checks for the 'PublicIpAddress' field.
-    4. If the public IP is found, it is returned immediately.
-    5. If the public IP is not found, the function waits for the specified delay before retrying.
-    6. If the retries are exhausted without retrieving a public IP, the function raises an exception.
+    1. The function checks with `describe_images` if an available image named `image_name` is owned by the account.
+    2. If the image exists, its ID is returned immediately.
+    3. Otherwise, a single t2.micro builder instance is launched from the base AMI.
+    4. Once cloud-init has finished on the builder instance, the FastAPI install command is executed over SSH.
+    5. An image is created from the builder instance with `create_image`, and the function waits until it is available.
+    6. The builder instance is terminated (even if a step failed) and the new image ID is returned.
 
     Parameters:
         ec2: A Boto3 EC2 client object to interact with AWS EC2 service.
-        instance_id: The ID of the EC2 instance to check for a public IP.
-        retries: The number of attempts to check for the public IP (default is 10).
-        delay: The amount of time (in seconds) to wait between retries (default is 10 seconds).
+        ami_id: The base Amazon Machine Image (AMI) ID used to build the image.
+        key_name: The key pair name to associate with the builder instance.
+        key_file: The path to the .pem file used to connect to the builder instance.
+        subnet_id: The subnet ID where the builder instance will be launched.
+        security_group_id: The security group ID to assign to the builder instance.
+        image_name: The name of the baked image (default is 'fastapi-base').
 
     Returns:
-        The public IP address of the instance if available.
+        The ID of the AMI with FastAPI pre-installed.
 
     Raises:
-        Exception: If the public IP is not retrieved after the specified number of retries.
+        Exception: If the builder instance cannot be reached over SSH, or if the install fails on it
+                   (no image is created in that case).
     '''
 
-    # Loop over the specified number of retries
-    for attempt in range(retries):
-        # Describe the instance to fetch its details
-        response = ec2.describe_instances(InstanceIds=[instance_id])
-        
-        # Try to get the public IP address from the response
-        public_ip = response['Reservations'][0]['Instances'][0].get('PublicIpAddress')
-        
-        # If a public IP is found, return it
-        if public_ip:
-            return public_ip
-        
-        # Wait for the specified delay before the next retry
-        time.sleep(delay)
-    
-    # Raise an exception if the public IP is not retrieved after all retries
-    raise Exception(f"Public IP for instance {instance_id} could not be retrieved.")
+    # Reuse the image if it was already baked
+    images = ec2.describe_images(
+        Owners=['self'],
+        Filters=[{'Name': 'name', 'Values': [image_name]}, {'Name': 'state', 'Values': ['available']}]
+    )['Images']
+    if images:
+        print(f"Reusing image '{image_name}': {images[0]['ImageId']}")
+        return images[0]['ImageId']
+
+    # Launch a builder instance from the base AMI
+    print(f"Baking image '{image_name}' from {ami_id}...")
+    builder_id = create_instances(ec2=ec2, ami_id=ami_id, key_name=key_name, subnet_id=subnet_id,
+                                  security_group_id=security_group_id, instance_type='t2.micro', num_instances=1)[0]
+    try:
+        builder_ip = get_public_ids(ec2=ec2, instance_ids=[builder_id])[0]
+
+        # Install the FastAPI environment on the builder instance
+        client = wait_for_ssh(builder_ip, 'ubuntu', key_file)
+        if client is None:
+            raise Exception(f"Could not connect to builder instance {builder_id}.")
+        try:
+            # Let cloud-init finish its own apt run first, so the install does not race it for the dpkg lock
+            # (its exit status is ignored; only the install result decides whether the image is created)
+            installed = ssh_exec_command(client, ['cloud-init status --wait > /dev/null || true', FASTAPI_INSTALL_COMMAND])
+        finally:
+            client.close()
+        if not installed:
+            raise Exception(f"FastAPI install failed on builder instance {builder_id}.")
+
+        # Create the image and wait until it can be used to launch instances
+        image_id = ec2.create_image(InstanceId=builder_id, Name=image_name)['ImageId']
+        ec2.get_waiter('image_available').wait(ImageIds=[image_id])
+        print(f"Image '{image_name}' is now available: {image_id}")
+    finally:
+        # The builder instance is no longer needed once the image exists
+        ec2.terminate_instances(InstanceIds=[builder_id])
 
+    # Return the ID of the baked image
+    return image_id
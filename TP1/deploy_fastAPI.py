@@ -1,93 +1,230 @@
 import time
 #for SCP transfer
 import paramiko
-import os
+#for tuning the TCP socket used by SSH
+import socket
+#for quoting remote shell scripts
+import shlex
+#for streaming remote command output
+import select
+import sys
+#for sharing the parsed key between deployment threads
+import threading
 
 
 
 
 
-#SSH Connection 
-def wait_for_ssh(ip_address, username, private_key_path, retries=10, delay=30):
+# Parsed private keys, keyed by path, so each .pem file is read once per run.
+# The lock keeps concurrent deployments from parsing the same key several times.
+_KEY_CACHE = {}
+_KEY_CACHE_LOCK = threading.Lock()
+
+# TCP socket buffer size and SSH window/packet sizes used for every connection
+SOCKET_BUFFER_SIZE = 32 * 1024 * 1024
+SSH_WINDOW_SIZE = 3 * 1024 * 1024
+SSH_MAX_PACKET_SIZE = 512 * 1024
+
+# Shell command installing Python, tmux and the FastAPI virtual environment (with aiohttp and uvloop for the benchmark).
+# uvicorn[standard] brings uvloop and httptools for the server.
+# It is skipped when the venv already has every package, e.g. on instances launched from the pre-baked AMI.
+FASTAPI_INSTALL_COMMAND = 'fastapi_env/bin/python -c "import fastapi, uvicorn, uvloop, httptools, aiohttp" 2>/dev/null || bash -lc ' + shlex.quote(' && '.join([
+    'sudo apt-get update -y',
+    'sudo apt-get install python3-pip python3-venv tmux -y',
+    'python3 -m venv fastapi_env',
+    'source fastapi_env/bin/activate',
+    "pip install fastapi 'uvicorn[standard]' aiohttp uvloop"
+]))
+
+# Shell command starting the FastAPI app in a tmux session, with one uvicorn worker process per vCPU
+# and the uvloop event loop and httptools parser instead of the pure-Python defaults
+FASTAPI_RUN_COMMAND = ('tmux new-session -d -s fastapi_session "cd /home/ubuntu && source fastapi_env/bin/activate && '
+                       'uvicorn main:app --host 0.0.0.0 --port 8000 --workers $(nproc) --loop uvloop --http httptools"')
+
+
+def load_private_key(private_key_path):
+    """
+    Loads the RSA private key from disk, parsing each key file only once per process, even when
+    several threads deploy to different hosts at the same time.
+
+    Args:
+    private_key_path (str): Path to the private key (.pem) used to authenticate the SSH connection.
+
+    Returns:
+    paramiko.RSAKey: The parsed private key.
     """
-    Tries to establish an SSH connection to a given EC2 instance multiple times until successful or retries run out.
+    with _KEY_CACHE_LOCK:
+        key = _KEY_CACHE.get(private_key_path)
+        if key is None:
+            key = paramiko.RSAKey.from_private_key_file(private_key_path)
+            _KEY_CACHE[private_key_path] = key
+    return key
+
+
+# Function to open a tuned SSH connection
+def connect_ssh(ip_address, username, key, timeout=10):
+    """
+    Opens an SSH connection over a TCP socket tuned for throughput: TCP_NODELAY is set, the socket
+    buffers are enlarged, and the SSH transport uses a larger window and maximum packet size.
 
     Args:
     ip_address (str): The public IP address of the EC2 instance.
     username (str): The SSH username (usually 'ubuntu').
-    private_key_path (str): Path to the private key (.pem) used to authenticate the SSH connection.
-    retries (int): Number of retries before failing (default is 10).
-    delay (int): Delay between retries in seconds (default is 30 seconds).
+    key (paramiko.RSAKey): The parsed private key used to authenticate the SSH connection.
+    timeout (int): Timeout in seconds for the TCP connection and SSH handshake (default is 10 seconds).
 
     Returns:
-    bool: True if SSH connection is successful, False if all retries fail.
+    paramiko.SSHClient: The connected SSH client.
     """
-    key = paramiko.RSAKey.from_private_key_file(private_key_path)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+    sock.settimeout(timeout)
+    try:
+        sock.connect((ip_address, 22))
+    except OSError:
+        sock.close()
+        raise
+
     client = paramiko.SSHClient()
     client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    try:
+        client.connect(
+            hostname=ip_address, username=username, pkey=key, sock=sock, timeout=timeout,
+            transport_factory=lambda transport_sock, **kwargs: paramiko.Transport(
+                transport_sock,
+                default_window_size=SSH_WINDOW_SIZE,
+                default_max_packet_size=SSH_MAX_PACKET_SIZE,
+                **kwargs
+            )
+        )
+    except Exception:
+        client.close()
+        sock.close()
+        raise
+    return client
+
 
-    for attempt in range(retries):
+#SSH Connection 
+def wait_for_ssh(ip_address, username, private_key_path, max_wait=300, initial_delay=0.5, max_delay=15):
+    """
+    Tries to establish an SSH connection to a given EC2 instance until successful or the time budget runs out.
+    Retries use an exponential backoff, so an instance that is ready early is reached without waiting a full period.
+    The connection is kept open so that the caller can reuse it for every subsequent command and transfer.
+
+    Args:
+    ip_address (str): The public IP address of the EC2 instance.
+    username (str): The SSH username (usually 'ubuntu').
+    private_key_path (str): Path to the private key (.pem) used to authenticate the SSH connection.
+    max_wait (int): Maximum total time in seconds to keep retrying (default is 300 seconds).
+    initial_delay (float): Delay before the first retry in seconds (default is 0.5 seconds).
+    max_delay (float): Maximum delay between retries in seconds (default is 15 seconds).
+
+    Returns:
+    paramiko.SSHClient: The connected client if SSH connection is successful, None if all retries fail.
+    """
+    key = load_private_key(private_key_path)
+    delay = initial_delay
+    deadline = time.monotonic() + max_wait
+    attempt = 0
+
+    while True:
+        attempt += 1
         try:
-            print(f"Attempting SSH connection to {ip_address} (Attempt {attempt+1}/{retries})...")
-            client.connect(hostname=ip_address, username=username, pkey=key, timeout=10)
-            client.close()
+            print(f"Attempting SSH connection to {ip_address} (Attempt {attempt})...")
+            client = connect_ssh(ip_address, username, key, timeout=10)
             print(f"SSH connection to {ip_address} successful!")
-            return True
-        except paramiko.ssh_exception.NoValidConnectionsError as e:
-            print(f"SSH connection failed: {e}")
+            return client
         except paramiko.AuthenticationException as e:
             print(f"SSH Authentication failed: {e}")
         except paramiko.SSHException as e:
             print(f"General SSH error: {e}")
+        except OSError as e:
+            print(f"SSH connection failed: {e}")
         except Exception as e:
             print(f"Unexpected error: {e}")
+
+        if time.monotonic() + delay > deadline:
+            break
         
         print(f"Waiting {delay} seconds before retrying...")
         time.sleep(delay)
+        delay = min(delay * 2, max_delay)
     
-    print(f"Unable to establish SSH connection to {ip_address} after {retries} attempts.")
-    return False
+    print(f"Unable to establish SSH connection to {ip_address} after {attempt} attempts.")
+    return None
+
+
+# Function to run one SSH command and stream its output as it arrives
+def stream_command(client, command, get_pty=False):
+    """
+    Runs a command over an already-connected SSH session and writes its stdout/stderr to the local console
+    as soon as the data arrives, instead of buffering the whole output until the command finishes.
+
+    Args:
+    client (paramiko.SSHClient): The connected SSH client returned by `wait_for_ssh`.
+    command (str): The shell command to execute on the remote EC2 instance.
+    get_pty (bool): Whether to request a pseudo-terminal for the command (default is False).
+
+    Returns:
+    int: The exit status of the remote command.
+    """
+    channel = client.get_transport().open_session()
+    if get_pty:
+        channel.get_pty()
+    channel.exec_command(command)
+
+    while True:
+        # Block until the channel has data (or a short timeout) instead of spinning
+        select.select([channel], [], [], 1.0)
+        if channel.recv_ready():
+            sys.stdout.write(channel.recv(65536).decode(errors='replace'))
+            sys.stdout.flush()
+        if channel.recv_stderr_ready():
+            sys.stderr.write(channel.recv_stderr(65536).decode(errors='replace'))
+            sys.stderr.flush()
+        if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+            break
+
+    exit_status = channel.recv_exit_status()
+    channel.close()
+    return exit_status
 
 
 # Function to execute SSH commands via Paramiko
-def ssh_exec_command(ip_address, username, private_key_path, commands):
+def ssh_exec_command(client, commands, pty=False):
     """
-    Executes a list of commands over SSH on the specified EC2 instance.
+    Executes a list of commands over an already-connected SSH session on an EC2 instance.
+    No pseudo-terminal is allocated by default, which saves a request per command and keeps stdout and stderr apart.
 
     Args:
-    ip_address (str): The public IP address of the EC2 instance.
-    username (str): The SSH username (usually 'ubuntu').
-    private_key_path (str): Path to the private key (.pem) used to authenticate the SSH connection.
+    client (paramiko.SSHClient): The connected SSH client returned by `wait_for_ssh`.
     commands (list): A list of shell commands (str) to be executed on the remote EC2 instance.
+    pty (bool): Whether to request a pseudo-terminal, only needed by interactive tools (default is False).
 
     Returns:
-    None: Outputs the result of the executed commands to the console.
+    bool: True if every command exited with status 0, False as soon as one fails (the remaining ones are skipped).
     """
-    key = paramiko.RSAKey.from_private_key_file(private_key_path)
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    client.connect(hostname=ip_address, username=username, pkey=key)
-    
     for command in commands:
-        stdin, stdout, stderr = client.exec_command(command, get_pty=True)
-        stdout.channel.recv_exit_status()
-        print(stdout.read().decode())
-        print(stderr.read().decode())
-    
-    client.close()
+        exit_status = stream_command(client, command, get_pty=pty)
+        if exit_status != 0:
+            print(f"Remote command failed with exit status {exit_status}")
+            return False
+    return True
 
 
-# Function to create the FastAPI app Python file with the instance ID and cluster
-def create_fastapi_app_file(instance_id, cluster_name):
+# Function to render the FastAPI app source with the instance ID and cluster
+def render_fastapi_app(instance_id, cluster_name):
     """
-    Generates a FastAPI Python file with routes that respond based on the EC2 instance ID and cluster name.
+    Renders the source of a FastAPI app with routes that respond based on the EC2 instance ID and cluster name.
 
     Args:
     instance_id (str): The EC2 instance ID to include in the response.
     cluster_name (str): The name of the cluster to create a route for (e.g., 'cluster1', 'cluster2').
 
     Returns:
-    str: The local file path to the generated FastAPI app Python file.
+    str: The Python source of the FastAPI app.
     """
     app_content = f"""
 from fastapi import FastAPI
@@ -117,77 +254,34 @@ if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
 """
-    #Save locally
-    # Ensure the deployment directory exists
-    os.makedirs('deployment', exist_ok=True)
-
-    filename = f"deployment/main_{instance_id}.py"
-    with open(filename, 'w') as f:
-        f.write(app_content)
-    return filename
-
-
-# Function to transfer files via SCP (Paramiko)
-def transfer_file(ip_address, username, private_key_path, local_filepath, remote_filepath):
-    """
-    Transfers a file from the local machine to the specified EC2 instance using SCP (via Paramiko).
-
-    Args:
-    ip_address (str): The public IP address of the EC2 instance.
-    username (str): The SSH username (usually 'ubuntu').
-    private_key_path (str): Path to the private key (.pem) used to authenticate the SCP connection.
-    local_filepath (str): The local path to the file that needs to be transferred.
-    remote_filepath (str): The destination path on the EC2 instance where the file should be transferred.
-
-    Returns:
-    None: Transfers the file and closes the connection.
-    """
-    key = paramiko.RSAKey.from_private_key_file(private_key_path)
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    client.connect(hostname=ip_address, username=username, pkey=key)
-    scp = client.open_sftp()
-    scp.put(local_filepath, remote_filepath)
-    scp.close()
-    client.close()
-
+    return app_content
 
 
-# Function to set up FastAPI app on the EC2 instance
-def setup_fastapi_app(ip_address, username, private_key_path, instance_id, cluster_name):
+# Function to build the cloud-init script that deploys the FastAPI app at boot
+def create_fastapi_user_data(cluster_name):
     """
-    Sets up a FastAPI application on the EC2 instance, including installing necessary packages and transferring app files.
+    Builds a cloud-init (UserData) shell script that deploys the FastAPI app while the instance boots,
+    so no SSH session is needed: the app file is written with the instance's own ID, the virtual
+    environment is installed if missing, and uvicorn is started in a tmux session as the 'ubuntu' user.
 
     Args:
-    ip_address (str): The public IP address of the EC2 instance.
-    username (str): The SSH username (usually 'ubuntu').
-    private_key_path (str): Path to the private key (.pem) used for SSH.
-    instance_id (str): The ID of the EC2 instance, used to identify it in the app.
-    cluster_name (str): The name of the cluster ('cluster1' or 'cluster2'), used to route requests accordingly.
+    cluster_name (str): The name of the cluster to create a route for (e.g., 'cluster1', 'cluster2').
 
     Returns:
-    None: Executes the setup commands and deploys the FastAPI app on the EC2 instance.
+    str: The UserData script to pass to `run_instances`.
     """
-    if not wait_for_ssh(ip_address, username, private_key_path):
-        print(f"Failed to establish SSH connection to {ip_address}")
-        return
-    
-    # Commands to install Python, FastAPI, and tmux
-    commands = [
-        'sudo apt-get update -y',
-        'sudo apt-get install python3-pip python3-venv tmux -y',
-        'python3 -m venv fastapi_env',
-        'bash -c "source fastapi_env/bin/activate && pip install fastapi uvicorn"'
-    ]
-    ssh_exec_command(ip_address, username, private_key_path, commands)
-
-    # Transfer FastAPI app to the instance
-    local_filepath = create_fastapi_app_file(instance_id, cluster_name)
-    remote_filepath = '/home/ubuntu/main.py'
-    transfer_file(ip_address, username, private_key_path, local_filepath, remote_filepath)
-
-    # Run FastAPI in a tmux session to keep it alive
-    tmux_command = 'tmux new-session -d -s fastapi_session "cd /home/ubuntu && source fastapi_env/bin/activate && uvicorn main:app --host 0.0.0.0 --port 8000"'
-    ssh_exec_command(ip_address, username, private_key_path, [tmux_command])
-
-
+    app_content = render_fastapi_app('__INSTANCE_ID__', cluster_name)
+
+    return '\n'.join([
+        '#!/bin/bash',
+        # Write the app, then fill in the instance ID known only at boot
+        "cat > /home/ubuntu/main.py <<'FASTAPI_APP'",
+        app_content,
+        'FASTAPI_APP',
+        'sed -i "s/__INSTANCE_ID__/$(cloud-init query v1.instance_id)/" /home/ubuntu/main.py',
+        'chown ubuntu:ubuntu /home/ubuntu/main.py',
+        # Install the environment (no-op on the pre-baked AMI) and start the app as the 'ubuntu' user
+        f'sudo -iu ubuntu bash -c {shlex.quote(FASTAPI_INSTALL_COMMAND)}',
+        f'sudo -iu ubuntu bash -c {shlex.quote(FASTAPI_RUN_COMMAND)}',
+        ''
+    ])
@@ -1,5 +1,8 @@
 #for managing error in aws
 from botocore.exceptions import ClientError
+#for creating the rules concurrently
+from concurrent.futures import ThreadPoolExecutor
+import itertools
 
 
 def create_load_balancer(elbv2, load_balancer_name, subnets, security_group_id):
@@ -132,3 +135,47 @@ def create_rule(elbv2, listener_arn, target_group_arn, path, priority):
 
     # Return the created rule's details
     return rule
+
+
+#Create the rules of several target groups at once
+def create_rules_bulk(elbv2, listener_arn, path_to_target_group):
+    '''
+    This function creates one forwarding rule per path pattern on an existing listener, assigning the
+    priorities locally from a single `describe_rules` call and creating all the rules concurrently.
+
+    Steps:
+    1. The function accepts three parameters: the ELBv2 client object, the listener ARN, and a dictionary
+       mapping each path pattern to the ARN of the target group it forwards to.
+    2. It calls `describe_rules` once to find the priorities already used on the listener.
+    3. Each path pattern gets the lowest free priority, in the order of the dictionary.
+    4. The `create_rule` calls are submitted concurrently with a thread pool.
+    5. Finally, the function returns the details of every created rule.
+
+    Parameters:
+        elbv2: A Boto3 ELBv2 client object to interact with AWS Elastic Load Balancing (ELBv2).
+        listener_arn: The Amazon Resource Name (ARN) of the listener to which the rules will be attached.
+        path_to_target_group: A dictionary mapping each path pattern (e.g. '/cluster1') to a target group ARN.
+
+    Returns:
+        A list of the response objects of the created rules, in the order of `path_to_target_group`.
+
+    Raises:
+        ClientError: If there is an issue with the ELBv2 API calls, an exception will be raised.
+    '''
+
+    # Find the priorities already used on the listener (the default rule has the priority 'default')
+    existing_rules = elbv2.describe_rules(ListenerArn=listener_arn)['Rules']
+    used_priorities = {int(rule['Priority']) for rule in existing_rules if rule['Priority'].isdigit()}
+
+    # Assign the lowest free priorities, in order
+    free_priorities = (priority for priority in itertools.count(1) if priority not in used_priorities)
+    rules = [(path, target_group_arn, next(free_priorities)) for path, target_group_arn in path_to_target_group.items()]
+    if not rules:
+        return []
+
+    # Create every rule concurrently
+    with ThreadPoolExecutor(max_workers=min(len(rules), 8)) as executor:
+        return list(executor.map(
+            lambda rule: create_rule(elbv2=elbv2, listener_arn=listener_arn, target_group_arn=rule[1], path=rule[0], priority=rule[2]),
+            rules
+        ))
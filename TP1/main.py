@@ -1,35 +1,35 @@
-#aws library
-import boto3
+#aws clients shared by every module
+from aws_clients import ec2, elbv2, warm_up_clients
 #import vpc,subnet_id,create_security_group
 from netwrok_connection import get_vpc,get_subnet_id,create_security_group
 #keypair and creat isntaces
-from create_instances import create_key_pair,create_instances,get_public_ids
+from create_instances import create_key_pair,create_instances,get_public_ids,create_fastapi_image
 
 #deployement FAST API
-from deploy_fastAPI import setup_fastapi_app
+from deploy_fastAPI import create_fastapi_user_data
 
 #target group
 from target_groups import create_target_group,register_instances,wait_for_target_group_health
 
 
 #load balancer 
-from loadbalancer import create_load_balancer,create_listener,create_rule
+from loadbalancer import create_load_balancer,create_listener,create_rules_bulk
 
 #benckmark
-from benckmarking import execute_benchmark_script_on_instance
+from benckmarking import execute_benchmark_script_on_instance,run_benchmark
 
 #cloud watch
-from cloudwatch import plot_comparison_metrics,get_ec2_metrics,get_target_group_arn,get_instance_ids_from_target_group
-from cloudwatch_loadbalancer import get_load_balancer_arn,plot_metrics,get_load_balancer_request_count
-import time
+from cloudwatch import plot_comparison_metrics,get_ec2_metrics_batch,get_instance_ids_per_target_group,average_series
+from cloudwatch_loadbalancer import get_load_balancer_arn,plot_metrics,wait_for_load_balancer_request_count
+import asyncio
+from datetime import datetime, timezone
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 #terminate ressources
 from terminate_resources import delete_all_load_balancers,delete_all_target_groups,terminate_all_instances
 
 
-# Creating an EC2 client
-ec2 = boto3.client('ec2',region_name='us-east-1')
-elbv2 = boto3.client('elbv2',region_name='us-east-1')
 
 
 
@@ -37,58 +37,60 @@ elbv2 = boto3.client('elbv2',region_name='us-east-1')
 vpc_id=get_vpc(ec2=ec2)
 
 
-#2. get subnet_id
-subnet_ids=get_subnet_id(ec2=ec2,vpc_id=vpc_id)
-# print(subnet_ids)
-subnet_id_1=subnet_ids[0]
-
-#3. create security_group
-securiy_group_id=create_security_group(ec2=ec2,vpc_id=vpc_id)
-
-#4. create keypair
+#2-4. get subnet_id, create security_group and create keypair
 #name of keypair
 key_name = 'my-key-pair'
 #path of keypair
 key_file = f"./{key_name}.pem"
-create_key_pair(ec2=ec2,key_name=key_name,key_file=key_file)
+#the three steps only depend on the VPC and reuse what already exists, so they run concurrently
+with ThreadPoolExecutor(max_workers=3) as executor:
+    subnet_ids_future = executor.submit(get_subnet_id, ec2=ec2, vpc_id=vpc_id)
+    security_group_future = executor.submit(create_security_group, ec2=ec2, vpc_id=vpc_id)
+    key_pair_future = executor.submit(create_key_pair, ec2=ec2, key_name=key_name, key_file=key_file)
+    subnet_ids = subnet_ids_future.result()
+    securiy_group_id = security_group_future.result()
+    key_pair_future.result()
+# print(subnet_ids)
+subnet_id_1=subnet_ids[0]
 
 #5. create instance:
 #5.creatting instance for micro and large
 #ubuntu ami
-ami_id = 'ami-0e86e20dae9224db8'
+base_ami_id = 'ami-0e86e20dae9224db8'
+#ubuntu ami with FastAPI pre-installed (baked on the first run, reused afterwards)
+ami_id = create_fastapi_image(ec2=ec2, ami_id=base_ami_id, key_name=key_name, key_file=key_file,
+                              subnet_id=subnet_id_1, security_group_id=securiy_group_id)
 #CPU type
 instance_type_micro='t2.micro'
 #number of instances
 nb_instances_micro=5
-#creation instances
-instance_ids_micro=create_instances(ec2=ec2,ami_id=ami_id,key_name=key_name,
-                                    subnet_id=subnet_id_1,security_group_id=securiy_group_id,
-                                    instance_type=instance_type_micro, num_instances=
-                                    nb_instances_micro)
-#get ip of instances
-instance_ips_micro=get_public_ids(ec2=ec2,instance_ids=instance_ids_micro)
-
 #CPU type
 instance_type_large='t2.large'
 #number of instances
 nb_instances_large=4
-#creation instances
-instance_ids_large=create_instances(ec2=ec2,ami_id=ami_id,key_name=key_name,
-                                    subnet_id=subnet_id_1,security_group_id=securiy_group_id,
-                                    instance_type=instance_type_large, 
-                                    num_instances=nb_instances_large)
-#get ip of instances
-instance_ips_large=get_public_ids(ec2=ec2,instance_ids=instance_ids_large)
+#creation instances: FastAPI is deployed by cloud-init at boot (cluster1 on micro, cluster2 on large),
+#and both clusters are launched concurrently, so provisioning takes max(micro, large) instead of the sum
+with ThreadPoolExecutor(max_workers=2) as executor:
+    future_micro = executor.submit(create_instances, ec2=ec2, ami_id=ami_id, key_name=key_name,
+                                   subnet_id=subnet_id_1, security_group_id=securiy_group_id,
+                                   instance_type=instance_type_micro, num_instances=nb_instances_micro,
+                                   user_data=create_fastapi_user_data("cluster1"))
+    future_large = executor.submit(create_instances, ec2=ec2, ami_id=ami_id, key_name=key_name,
+                                   subnet_id=subnet_id_1, security_group_id=securiy_group_id,
+                                   instance_type=instance_type_large, num_instances=nb_instances_large,
+                                   user_data=create_fastapi_user_data("cluster2"))
+    instance_ids_micro = future_micro.result()
+    instance_ids_large = future_large.result()
+
+#get ip of instances (a single batched lookup for both clusters)
+instance_ips = get_public_ids(ec2=ec2, instance_ids=[*instance_ids_micro, *instance_ids_large])
+instance_ips_micro = instance_ips[:len(instance_ids_micro)]
+instance_ips_large = instance_ips[len(instance_ids_micro):]
 
 
 #6. Deploy FAST API
-# Deploy to t2.micro instances (Cluster 1)
-for instance_id, public_ip in zip(instance_ids_micro, instance_ips_micro):
-    setup_fastapi_app(public_ip, 'ubuntu', key_file, instance_id, "cluster1")
-
-# Deploy to t2.large instances (Cluster 2)
-for instance_id, public_ip in zip(instance_ids_large, instance_ips_large):
-    setup_fastapi_app(public_ip, 'ubuntu', key_file, instance_id, "cluster2")
+# Nothing to do here: each instance deploys the app from its UserData while booting,
+# and the target group health checks (step 12) confirm that the app is serving
 
 
 #6. Create target group
@@ -115,20 +117,10 @@ listener_arn=create_listener(elbv2=elbv2,lb_arn=load_balancer_arn,
 
 #9. Configure rules
 #Create rules for target groups
-cluster1_rule=create_rule(elbv2=elbv2,listener_arn=listener_arn,target_group_arn=target_group_arn_cluster1, path='/cluster1', priority=1)
-cluster2_rule=create_rule(elbv2=elbv2,listener_arn=listener_arn,target_group_arn=target_group_arn_cluster2, path='/cluster2', priority=2)
-
-#10. Activate all instances
-# start the instances created in cluster 1 => micro
-ec2.start_instances(InstanceIds = instance_ids_micro)   
+cluster1_rule,cluster2_rule=create_rules_bulk(elbv2=elbv2,listener_arn=listener_arn,
+                                              path_to_target_group={'/cluster1':target_group_arn_cluster1,'/cluster2':target_group_arn_cluster2})
 
-# start the instances created in cluster 2 => large
-ec2.start_instances(InstanceIds = instance_ids_large)
-
-# wait for all instances to be running before proceeding
-instanceIds = [*instance_ids_micro, *instance_ids_large]
-waiter = ec2.get_waiter('instance_running')
-waiter.wait(InstanceIds = instanceIds)
+#10. Instances are already running: create_instances waits for the 'instance_running' state
 
 #11. Register instances in target groups
 register_instances(elbv2=elbv2,target_group_arn=target_group_arn_cluster1, instance_ids=instance_ids_micro)
@@ -137,80 +129,68 @@ register_instances(elbv2=elbv2,target_group_arn=target_group_arn_cluster2, insta
 #12.Benchmarking
 
 #a. wait until all target groups become healthy
-health_status_cluster1=wait_for_target_group_health(elbv2=elbv2,target_group_arn=target_group_arn_cluster1, max_retries=10, delay=60)
-health_status_cluster2=wait_for_target_group_health(elbv2=elbv2,target_group_arn=target_group_arn_cluster2, max_retries=10, delay=60)
-
-
-#b. send benchmark file for each cluster
+health_status_cluster1=wait_for_target_group_health(elbv2=elbv2,target_group_arn=target_group_arn_cluster1, max_retries=120, delay=5)
+health_status_cluster2=wait_for_target_group_health(elbv2=elbv2,target_group_arn=target_group_arn_cluster2, max_retries=120, delay=5)
+
+
+#b. run the benchmark against the load balancer
+#set to True to run it from an EC2 instance (in-VPC latency) instead of this machine
+remote_benchmark = False
+#number of requests sent to the load balancer
+nb_requests = 1000
+#open the CloudWatch/ELB connections used by steps 13 and 14 in the background while the benchmark runs
+warm_up_thread = threading.Thread(target=warm_up_clients, daemon=True)
+warm_up_thread.start()
 if health_status_cluster1 and health_status_cluster2:
-    #pick an instance_ip randomly
-    ec2_radom_ip=instance_ips_large[0]
-    #send script to this machine and run script 
-    execute_benchmark_script_on_instance(instance_ip=ec2_radom_ip, load_balancer_url=ec2_url, pem_key_path=key_file, user='ubuntu')
+    if remote_benchmark:
+        #pick an instance_ip randomly
+        ec2_radom_ip=instance_ips_large[0]
+        #send script to this machine and run script 
+        execute_benchmark_script_on_instance(instance_ip=ec2_radom_ip, load_balancer_url=ec2_url, pem_key_path=key_file, user='ubuntu', num_requests=nb_requests)
+    else:
+        #send the requests directly from this machine
+        asyncio.run(run_benchmark(ec2_url, num_requests=nb_requests))
+#end of the benchmark, used by step 14 to wait for its complete RequestCount in CloudWatch
+benchmark_end = datetime.now(timezone.utc)
 
 #13.Cloud watch
 # Define the target group names
 
 target_group_names = ['cluster1-target-group', 'cluster2-target-group']  # Replace with your actual target group names
 
-# Loop through each target group and fetch the metrics
-aggregated_data = {}
-for target_group_name in target_group_names:
-    # Dynamically get the Target Group ARN
-    target_group_arn = get_target_group_arn(target_group_name)
-
-    if target_group_arn:
-        # Fetch EC2 instance IDs from the target group
-        instance_ids = get_instance_ids_from_target_group(target_group_arn)
-
-        # Initialize containers for aggregated timestamps and values for each metric
-        aggregated_timestamps = []
-        aggregated_values = {}
-
-        # Loop over all EC2 instances in the target group and fetch their metrics
-        for metric_name in ['CPUUtilization', 'NetworkIn', 'NetworkOut']:
-            aggregated_values[metric_name] = []
-
-            for instance_id in instance_ids:
-                timestamps, values = get_ec2_metrics(instance_id, metric_name)
-
-                if timestamps and values:
-                    if not aggregated_timestamps:
-                        aggregated_timestamps = timestamps  # Initialize timestamps with the first instance
-                    if aggregated_timestamps == timestamps:
-                        # Add the values to the aggregated values list
-                        if not aggregated_values[metric_name]:
-                            aggregated_values[metric_name] = values
-                        else:
-                            aggregated_values[metric_name] = [sum(x) for x in zip(aggregated_values[metric_name], values)]
-                    else:
-                        print(f"Timestamps for {instance_id} are not aligned with other instances.")
-
-            # After iterating over instances, average the aggregated values
-            if aggregated_values[metric_name]:
-                aggregated_values[metric_name] = [x / len(instance_ids) for x in aggregated_values[metric_name]]
-
-            # Add aggregated data for each target group to the dictionary
-            if metric_name not in aggregated_data:
-                aggregated_data[metric_name] = {}
-            aggregated_data[metric_name][target_group_name] = (aggregated_timestamps, aggregated_values[metric_name])
+# Metrics collected for each target group, and the aggregated (timestamps, values) of each metric per target group
+metric_names = ['CPUUtilization', 'NetworkIn', 'NetworkOut']
+aggregated_data = {metric_name: {} for metric_name in metric_names}
+
+# Fetch the EC2 instance IDs of every target group concurrently, while the Load Balancer ARN
+# needed by step 14 is looked up in the background
+with ThreadPoolExecutor(max_workers=1) as executor:
+    lb_arn_future = executor.submit(get_load_balancer_arn, load_balancer_name)
+    instance_ids_per_target_group = get_instance_ids_per_target_group(target_group_names)
+    lb_arn = lb_arn_future.result()
+
+# Fetch every metric of every EC2 instance of all the target groups in a single batch
+all_instance_ids = [instance_id for instance_ids in instance_ids_per_target_group.values() for instance_id in instance_ids]
+metrics = get_ec2_metrics_batch(all_instance_ids, metric_names)
+
+for target_group_name, instance_ids in instance_ids_per_target_group.items():
+    # Average the metrics of all EC2 instances in the target group, one metric at a time.
+    # The series are aligned on their timestamps, so an instance missing a datapoint is not dropped.
+    for metric_name in metric_names:
+        aggregated_data[metric_name][target_group_name] = average_series(
+            metrics[(instance_id, metric_name)] for instance_id in instance_ids
+        )
 
 # Plot the comparison for each metric
-for metric_name in ['CPUUtilization', 'NetworkIn', 'NetworkOut']:
-    plot_comparison_metrics(aggregated_data[metric_name], metric_name)
-
+for metric_name, per_target_group in aggregated_data.items():
+    plot_comparison_metrics(per_target_group, metric_name)
 
-# Sleep for 5 minutes (300 seconds)
-print("Sleep for 5 minuts")
-time.sleep(300)
 
 #14. Cloud watch for load balancer
-# Dynamically get the Load Balancer ARN
-lb_arn = get_load_balancer_arn()
-
+# The Load Balancer ARN was retrieved during step 13
 if lb_arn:
-    # Fetch data and plot the RequestCount
-    timestamps, values = get_load_balancer_request_count(lb_arn)
+    # Wait (up to 5 minutes) until CloudWatch has the requests of the benchmark, then plot the RequestCount
+    timestamps, values = wait_for_load_balancer_request_count(lb_arn, until=benchmark_end)
     plot_metrics(timestamps, values)
 
 
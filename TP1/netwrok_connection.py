@@ -1,5 +1,3 @@
-#for managing error in aws
-from botocore.exceptions import ClientError
 
 #1. get VPC_id
 def get_vpc(ec2):
@@ -75,75 +73,62 @@ def get_subnet_id(ec2, vpc_id):
         return None
 
 
+# Ingress rules of the security group: HTTP, the FastAPI port, HTTPS and SSH, open to everyone
+SECURITY_GROUP_INGRESS = [
+    {'IpProtocol': 'tcp', 'FromPort': port, 'ToPort': port, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]}
+    for port in (80, 8000, 443, 22)
+]
+
+
 #3. create security group and return security id
-def create_security_group(ec2, vpc_id):
+def create_security_group(ec2, vpc_id, group_name='my-security-group-2'):
     '''
     This function creates or retrieves a security group in a given VPC using AWS Boto3.
 
     Steps:
-    1. The function accepts two arguments: an EC2 client object and a VPC ID.
-    2. It checks if a security group with the given group name ('my-security-group-2') already exists.
-    3. If the group exists, it checks whether the group is currently in use by other resources. 
-       If it is in use, the function returns the existing security group ID.
+    1. The function accepts an EC2 client object, a VPC ID and the name of the security group.
+    2. It looks the group up with a single `describe_security_groups` call filtered on the group name and the VPC,
+       which returns an empty list instead of raising an error when the group does not exist.
+    3. If the group exists, the function returns the existing security group ID (its rules are already configured).
     4. If the group does not exist, it creates a new security group in the specified VPC.
-    5. After creation, it configures ingress rules to allow traffic on ports 80, 8000, 443, and 22.
+    5. After creation, it configures ingress rules to allow traffic on ports 80, 8000, 443, and 22 in a single call.
     6. Finally, the function returns the security group ID.
 
     Parameters:
         ec2: A Boto3 EC2 client object to interact with AWS EC2 service.
         vpc_id: The ID of the VPC where the security group will be created.
+        group_name: The name of the security group (default is 'my-security-group-2').
 
     Returns:
         The ID of the security group, either existing or newly created.
-    '''
 
-    group_name = 'my-security-group-2'
+    Raises:
+        ClientError: If there is an issue with the EC2 API call, an exception will be raised.
+    '''
 
-    # Check if the security group already exists
-    try:
-        response = ec2.describe_security_groups(GroupNames=[group_name])
+    # Check if the security group already exists in the VPC
+    response = ec2.describe_security_groups(Filters=[
+        {'Name': 'group-name', 'Values': [group_name]},
+        {'Name': 'vpc-id', 'Values': [vpc_id]}
+    ])
+    if response['SecurityGroups']:
         security_group_id = response['SecurityGroups'][0]['GroupId']
         print(f"Security group '{group_name}' already exists with ID: {security_group_id}")
-
-        # Check if the security group is in use
-        try:
-            # If the group is in use by other resources, do not attempt to delete it
-            print(f"Security group '{group_name}' is in use. It will not be deleted.")
-            return security_group_id
-        except ClientError as e:
-            if 'DependencyViolation' in str(e):
-                print(f"Cannot delete security group '{group_name}' because it is associated with other resources.")
-            else:
-                raise e
+        return security_group_id
 
     # If the security group does not exist, create a new one
-    except ClientError as e:
-        if 'InvalidGroup.NotFound' in str(e):
-            print(f"Security group '{group_name}' does not exist, creating a new one.")
-
-            # Create a new security group
-            security_group = ec2.create_security_group(
-                GroupName=group_name,
-                Description="Security group for EC2 instances",  # Description must be in ASCII
-                VpcId=vpc_id
-            )
-
-            # Get the security group ID
-            security_group_id = security_group['GroupId']
-            print(f"Security group created: {security_group_id}")
-
-            # Configure the security group ingress rules
-            ec2.authorize_security_group_ingress(
-                GroupId=security_group_id,
-                IpPermissions=[
-                    {'IpProtocol': 'tcp', 'FromPort': 80, 'ToPort': 80, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
-                    {'IpProtocol': 'tcp', 'FromPort': 8000, 'ToPort': 8000, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
-                    {'IpProtocol': 'tcp', 'FromPort': 443, 'ToPort': 443, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]},
-                    {'IpProtocol': 'tcp', 'FromPort': 22, 'ToPort': 22, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]}
-                ]
-            )
-            print(f"Security group configured for ports 80, 8000, 443, and 22.")
-            return security_group_id
-
-        else:
-            raise e
+    print(f"Security group '{group_name}' does not exist, creating a new one.")
+    security_group = ec2.create_security_group(
+        GroupName=group_name,
+        Description="Security group for EC2 instances",  # Description must be in ASCII
+        VpcId=vpc_id
+    )
+
+    # Get the security group ID
+    security_group_id = security_group['GroupId']
+    print(f"Security group created: {security_group_id}")
+
+    # Configure the security group ingress rules
+    ec2.authorize_security_group_ingress(GroupId=security_group_id, IpPermissions=SECURITY_GROUP_INGRESS)
+    print(f"Security group configured for ports 80, 8000, 443, and 22.")
+    return security_group_id
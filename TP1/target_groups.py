@@ -6,16 +6,18 @@ import time
 def create_target_group(elbv2, group_name, vpc_id, path):
     '''
     This function checks if a target group already exists in AWS Elastic Load Balancing (ELBv2).
-    If the target group exists, it deletes the existing one and creates a new target group. 
-    If it does not exist, the function creates a new target group in the specified VPC.
+    If the target group exists with the expected settings, it is reused as is. If it exists with other settings,
+    it is deleted and created again. If it does not exist, the function creates a new target group in the specified VPC.
 
     Steps:
     1. The function accepts four parameters: ELBv2 client object, the target group name, VPC ID, and the health check path.
     2. It first tries to check if a target group with the specified name exists.
-    3. If the target group exists, it deletes the target group.
-    4. After deleting, or if the target group does not exist, it creates a new target group.
-    5. The new target group is created with an HTTP health check using the specified path and port.
-    6. Finally, the function returns the ARN of the created target group.
+    3. If the target group exists and its protocol, port, VPC and health check path match, its ARN is returned directly,
+       which avoids deleting a healthy target group and registering its targets again on every run.
+    4. If the target group exists with other settings, it deletes the target group.
+    5. After deleting, or if the target group does not exist, it creates a new target group.
+    6. The new target group is created with an HTTP health check using the specified path and port.
+    7. Finally, the function returns the ARN of the created target group.
 
     Parameters:
         elbv2: A Boto3 ELBv2 client object to interact with AWS Elastic Load Balancing (ELBv2).
@@ -24,60 +26,79 @@ def create_target_group(elbv2, group_name, vpc_id, path):
         path: The health check path for the target group's health monitoring.
 
     Returns:
-        The ARN of the created target group.
+        The ARN of the existing or created target group.
 
     Raises:
         ClientError: If there is an issue with the ELBv2 API call, an exception will be raised.
     '''
 
-    # Check if the target group already exists, and if so, delete it
+    # Settings of the target group, compared with the existing one to decide whether it can be reused
+    settings = {
+        'Protocol': 'HTTP',
+        'Port': 8000,
+        'VpcId': vpc_id,
+        'HealthCheckPath': f'/{path}',  # Use the provided health check path
+    }
+
+    # Check if the target group already exists
     try:
         response = elbv2.describe_target_groups(Names=[group_name])
-        target_group_arn = response['TargetGroups'][0]['TargetGroupArn']
+        target_group = response['TargetGroups'][0]
+        target_group_arn = target_group['TargetGroupArn']
         print(f"Target group '{group_name}' already exists with ARN: {target_group_arn}")
 
-        # Delete the existing target group
+        # Reuse the existing target group when its settings are the expected ones
+        if all(target_group.get(key) == value for key, value in settings.items()):
+            print(f"Target group '{group_name}' has the expected settings, reusing it.")
+            return target_group_arn
+
+        # Otherwise delete the existing target group before creating it again
         elbv2.delete_target_group(TargetGroupArn=target_group_arn)
         print(f"Target group '{group_name}' deleted.")
-    
-    # If the target group doesn't exist, create a new one
+
+    # If the target group doesn't exist, a new one is created below
     except ClientError as e:
         if 'TargetGroupNotFound' in str(e):
             print(f"Target group '{group_name}' does not exist yet, creating a new one.")
-
-            # Create a new target group after deletion (or if it doesn't exist)
-            response = elbv2.create_target_group(
-                Name=group_name,
-                Protocol='HTTP',
-                Port=8000,
-                VpcId=vpc_id,
-                HealthCheckProtocol='HTTP',
-                HealthCheckPath=f'/{path}',  # Use the provided health check path
-                HealthCheckPort='8000',
-                TargetType='instance'
-            )
-
-            # Get the target group ARN from the response
-            target_group_arn = response['TargetGroups'][0]['TargetGroupArn']
-            print(f"Target group created: {target_group_arn}")
-            return target_group_arn
         else:
             raise e
 
+    # Create a new target group after deletion (or if it doesn't exist)
+    response = elbv2.create_target_group(
+        Name=group_name,
+        HealthCheckProtocol='HTTP',
+        HealthCheckPort='8000',
+        TargetType='instance',
+        **settings
+    )
+
+    # Get the target group ARN from the response
+    target_group_arn = response['TargetGroups'][0]['TargetGroupArn']
+    print(f"Target group created: {target_group_arn}")
+    return target_group_arn
+
 #Register instances 
 # Function to register a list of instances to a target group
 def register_instances(elbv2,target_group_arn, instance_ids):
     """
     Registers a list of EC2 instances to a specific target group.
+    All the instances are registered with a single `register_targets` call, so callers should pass
+    the full list of instances of the target group instead of registering them one by one.
 
     Args:
     target_group_arn (str): The ARN of the target group where the instances will be registered.
-    instance_ids (list): A list of EC2 instance IDs to be registered.
+    instance_ids (iterable): The EC2 instance IDs to be registered.
 
     Returns:
     None: Registers the instances and prints success or error messages.
     """
 
+    # Materialize the IDs once so generators are accepted, and skip the call when there is nothing to register
+    instance_ids = list(instance_ids)
+    if not instance_ids:
+        print(f"No instances to register to target group {target_group_arn}.")
+        return
+
     try:
         # Register the instances to the target group
         elbv2.register_targets(
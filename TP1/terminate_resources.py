@@ -1,56 +1,59 @@
-import boto3
-
-# Initialize clients
-ec2_client = boto3.client('ec2')
-elb_v2_client = boto3.client('elbv2')
-elb_client = boto3.client('elb')
-
-def delete_listeners_for_load_balancer(load_balancer_arn):
+# Shared boto3 clients
+from aws_clients import ec2 as ec2_client, elbv2 as elb_v2_client, elb as elb_client
+#for deleting the resources concurrently
+from concurrent.futures import ThreadPoolExecutor
+#for flattening the paginated results
+from itertools import chain
+from operator import itemgetter
+
+# Instance states that still need to be terminated (shutting-down and terminated instances are skipped)
+TERMINABLE_INSTANCE_STATES = ['pending', 'running', 'stopping', 'stopped']
+# Maximum number of instance IDs accepted by a single TerminateInstances call
+TERMINATE_INSTANCES_BATCH_SIZE = 1000
+# Maximum number of load balancer ARNs accepted by a single DescribeLoadBalancers call
+DESCRIBE_LOAD_BALANCERS_BATCH_SIZE = 20
+# Maximum number of deletion calls running at the same time
+MAX_DELETE_WORKERS = 16
+
+
+def run_concurrently(function, items):
     """
-    This function deletes all listeners associated with a given Application Load Balancer (ALB) by its ARN.
-    
-    Steps:
-    1. The function accepts the ARN of the load balancer as a parameter.
-    2. It calls the `describe_listeners` method of the ELBv2 client to retrieve all listeners for the load balancer.
-    3. It iterates through the list of listeners, extracting the ARN for each listener.
-    4. For each listener, it prints a message indicating the listener ARN and proceeds to delete the listener using the `delete_listener` method.
-    5. No return value is provided. The function simply performs the deletion of the listeners.
+    This function calls `function` on every item concurrently and waits for all the calls to finish.
 
     Parameters:
-        load_balancer_arn: The ARN of the load balancer for which listeners will be deleted.
+        function: The function to call on each item.
+        items: The items to process.
 
     Returns:
-        None. The function deletes listeners and prints messages indicating the progress.
+        A list with the result of each call, in the same order as `items`.
 
     Raises:
-        Exception: If there are errors during the deletion process, they may be raised by the AWS SDK (Boto3).
+        The first exception raised by one of the calls, once every call has finished.
     """
+    items = list(items)
+    if not items:
+        return []
 
-    # Describe listeners for the specified load balancer
-    listeners = elb_v2_client.describe_listeners(LoadBalancerArn=load_balancer_arn)['Listeners']
-
-    # Iterate over each listener to delete it
-    for listener in listeners:
-        listener_arn = listener['ListenerArn']
-        print(f"Deleting listener with ARN: {listener_arn} for load balancer: {load_balancer_arn}")
-
-        # Delete the listener by its ARN
-        elb_v2_client.delete_listener(ListenerArn=listener_arn)
+    with ThreadPoolExecutor(max_workers=min(len(items), MAX_DELETE_WORKERS)) as executor:
+        futures = [executor.submit(function, item) for item in items]
+    return [future.result() for future in futures]
 
 
 def delete_all_load_balancers():
     """
     This function deletes all Application Load Balancers (ALBs), Network Load Balancers (NLBs),
-    and Classic Load Balancers (CLBs) in an AWS account. It first deletes the listeners 
-    for each ALB or NLB before deleting the load balancers themselves.
+    and Classic Load Balancers (CLBs) in an AWS account. Deleting an ALB or NLB also deletes its listeners,
+    so the listeners are not described and deleted one by one beforehand. The deletion is asynchronous, so the function
+    waits until the ALBs and NLBs are gone, after which their target groups are no longer in use and can be deleted.
     
     Steps:
-    1. The function retrieves all ALBs and NLBs using the `describe_load_balancers` method of the ELBv2 client.
-    2. For each load balancer, it deletes the associated listeners using the `delete_listeners_for_load_balancer` function.
-    3. After deleting the listeners, it deletes the load balancer itself by calling `delete_load_balancer`.
-    4. The function then retrieves all Classic Load Balancers (CLBs) using the `describe_load_balancers` method of the ELB client.
-    5. It iterates through the CLBs and deletes each one using `delete_load_balancer`.
+    1. The function retrieves all ALBs and NLBs with the `describe_load_balancers` paginator of the ELBv2 client.
+    2. It deletes each load balancer (and with it, its listeners) by calling `delete_load_balancer`.
+    3. It waits with the `load_balancers_deleted` waiter until every deleted load balancer is gone.
+    4. The function then retrieves all Classic Load Balancers (CLBs) with the `describe_load_balancers` paginator of the ELB client.
+    5. It deletes each CLB using `delete_load_balancer`.
     6. The function prints messages indicating the progress of deletion for both ALBs/NLBs and CLBs.
+    The load balancers of each kind are deleted concurrently.
 
     Parameters:
         None.
@@ -59,34 +62,44 @@ def delete_all_load_balancers():
         None. The function deletes all load balancers and their associated listeners.
 
     Raises:
-        Any errors raised by the AWS SDK (Boto3) during the load balancer or listener deletion process.
+        Any errors raised by the AWS SDK (Boto3) during the load balancer deletion process.
     """
 
     # Delete Application Load Balancers (ALBs) and Network Load Balancers (NLBs)
-    load_balancers = elb_v2_client.describe_load_balancers()['LoadBalancers']
+    pages = elb_v2_client.get_paginator('describe_load_balancers').paginate()
+    load_balancers = chain.from_iterable(page['LoadBalancers'] for page in pages)
 
-    # Iterate over each load balancer to delete its listeners and the load balancer itself
-    for lb in load_balancers:
+    # Delete each load balancer, its listeners are deleted along with it
+    def delete_load_balancer(lb):
         lb_arn = lb['LoadBalancerArn']
         lb_name = lb['LoadBalancerName']
-        
-        # Delete listeners associated with the load balancer
-        print(f"Deleting listeners for load balancer: {lb_name}")
-        delete_listeners_for_load_balancer(lb_arn)
-        
-        # Delete the load balancer
         print(f"Deleting load balancer: {lb_name} with ARN: {lb_arn}")
         elb_v2_client.delete_load_balancer(LoadBalancerArn=lb_arn)
+        return lb_arn
+
+    deleted_arns = run_concurrently(delete_load_balancer, load_balancers)
+
+    # Wait until the load balancers are deleted, so their target groups are released
+    # (DescribeLoadBalancers accepts at most 20 ARNs per call)
+    if deleted_arns:
+        print("Waiting for the load balancers to be deleted...")
+        waiter = elb_v2_client.get_waiter('load_balancers_deleted')
+        for start in range(0, len(deleted_arns), DESCRIBE_LOAD_BALANCERS_BATCH_SIZE):
+            waiter.wait(LoadBalancerArns=deleted_arns[start:start + DESCRIBE_LOAD_BALANCERS_BATCH_SIZE])
+        print("Load balancers deleted.")
     
     # Delete Classic Load Balancers (CLBs)
-    classic_load_balancers = elb_client.describe_load_balancers()['LoadBalancerDescriptions']
+    pages = elb_client.get_paginator('describe_load_balancers').paginate()
+    classic_load_balancers = chain.from_iterable(page['LoadBalancerDescriptions'] for page in pages)
 
-    # Iterate over each Classic Load Balancer and delete it
-    for clb in classic_load_balancers:
+    # Delete each Classic Load Balancer
+    def delete_classic_load_balancer(clb):
         clb_name = clb['LoadBalancerName']
         print(f"Deleting Classic Load Balancer: {clb_name}")
         elb_client.delete_load_balancer(LoadBalancerName=clb_name)
 
+    run_concurrently(delete_classic_load_balancer, classic_load_balancers)
+
 
 def delete_all_target_groups():
     """
@@ -100,6 +113,7 @@ def delete_all_target_groups():
     4. If a target group is currently in use (e.g., attached to a load balancer), it catches the `ResourceInUseException`
        and prints a message indicating that the target group cannot be deleted.
     5. If the target group is successfully deleted, a message indicating success is printed.
+    The target groups are deleted concurrently.
 
     Parameters:
         None.
@@ -115,8 +129,8 @@ def delete_all_target_groups():
     # Retrieve all target groups
     target_groups = elb_v2_client.describe_target_groups()['TargetGroups']
 
-    # Iterate over each target group to delete it
-    for tg in target_groups:
+    # Delete each target group
+    def delete_target_group(tg):
         tg_arn = tg['TargetGroupArn']
         tg_name = tg['TargetGroupName']
         
@@ -129,15 +143,19 @@ def delete_all_target_groups():
         except elb_v2_client.exceptions.ResourceInUseException:
             print(f"Target group {tg_name} is in use and cannot be deleted.")
 
+    run_concurrently(delete_target_group, target_groups)
+
 
 def terminate_all_instances():
     """
     This function terminates all EC2 instances in an AWS account.
     
     Steps:
-    1. The function retrieves all running EC2 instances by calling the `describe_instances` method of the EC2 client.
+    1. The function retrieves the EC2 instances that are not already shutting down or terminated, using the
+       `describe_instances` paginator with an `instance-state-name` filter so that every page is read.
     2. It extracts the instance IDs from the returned reservations and instances.
-    3. If there are any instances to terminate, the function calls `terminate_instances` to terminate them.
+    3. If there are any instances to terminate, the function calls `terminate_instances` to terminate them,
+       with up to 1000 instance IDs per call.
     4. It prints a message indicating which instances are being terminated.
     5. If no instances are found, a message is printed indicating that there are no instances to terminate.
 
@@ -151,16 +169,21 @@ def terminate_all_instances():
         Any errors raised by the AWS SDK (Boto3) during the instance termination process.
     """
 
-    # Retrieve all EC2 instances
-    instances = ec2_client.describe_instances()['Reservations']
+    # Retrieve every page of the EC2 instances that can still be terminated
+    paginator = ec2_client.get_paginator('describe_instances')
+    pages = paginator.paginate(Filters=[{'Name': 'instance-state-name', 'Values': TERMINABLE_INSTANCE_STATES}])
 
-    # Extract instance IDs from the instances
-    instance_ids = [instance['InstanceId'] for reservation in instances for instance in reservation['Instances']]
+    # Extract instance IDs from the instances, reading the pages as they are streamed by the paginator
+    reservations = chain.from_iterable(page['Reservations'] for page in pages)
+    instances = chain.from_iterable(reservation['Instances'] for reservation in reservations)
+    instance_ids = list(map(itemgetter('InstanceId'), instances))
     
     # If there are instances, terminate them
     if instance_ids:
         print(f"Terminating instances: {', '.join(instance_ids)}")
-        ec2_client.terminate_instances(InstanceIds=instance_ids)
+        batches = [instance_ids[start:start + TERMINATE_INSTANCES_BATCH_SIZE]
+                   for start in range(0, len(instance_ids), TERMINATE_INSTANCES_BATCH_SIZE)]
+        run_concurrently(lambda batch: ec2_client.terminate_instances(InstanceIds=batch), batches)
     else:
         # If no instances found, print a message
         print("No instances to terminate.")
@@ -3,7 +3,10 @@ from botocore.exceptions import ClientError
 #for getting permission on key pairs(chmod 400)
 import os
 import stat
-import time
+#for creating volumes and instances concurrently
+from concurrent.futures import ThreadPoolExecutor
+#for installing docker on the image builder instance
+from deploy_flaskApp import RemoteHost, DOCKER_INSTALL_COMMANDS
 
 #Create key pairs
 def create_key_pair(ec2, key_name, key_file):
@@ -72,37 +75,74 @@ def create_instances(ec2, ami_id, key_name, subnet_id, security_group_id, instan
         A list of tuples containing instance IDs and public IPs for the instances that were launched.
     '''
 
-    # Launch EC2 instances in the specified availability zone
-    response = ec2.run_instances(
-        ImageId=ami_id,
-        MinCount=num_instances,
-        MaxCount=num_instances,
-        InstanceType=instance_type,
-        KeyName=key_name,
-        SubnetId=subnet_id,
-        SecurityGroupIds=[security_group_id],
-        Placement={'AvailabilityZone': availability_zone},  # Specify the AZ here
-        TagSpecifications=[{
-            'ResourceType': 'instance',
-            'Tags': [{'Key': 'Name', 'Value': f'cluster-{instance_type}'}]
-        }],
-        Monitoring={'Enabled': True}
-    )
+    return create_instances_batch(ec2, [{
+        'ami_id': ami_id,
+        'key_name': key_name,
+        'subnet_id': subnet_id,
+        'security_group_id': security_group_id,
+        'instance_type': instance_type,
+        'num_instances': num_instances,
+        'availability_zone': availability_zone
+    }])[0]
+
+
+def create_instances_batch(ec2, launch_specs):
+    '''
+    Launch several groups of EC2 instances at once (e.g. the orchestrator and the workers).
+    All the run_instances calls are issued concurrently, then a single waiter and a single
+    describe_instances call cover every launched instance.
+
+    Parameters:
+        ec2: A Boto3 EC2 client object to interact with AWS EC2 service.
+        launch_specs: A list of dictionaries, each holding the arguments of `create_instances`
+                      (ami_id, key_name, subnet_id, security_group_id, instance_type, num_instances, availability_zone).
+
+    Returns:
+        A list with, for each launch spec, a list of tuples containing instance IDs and public IPs.
+    '''
+
+    def launch(spec):
+        # Launch EC2 instances in the specified availability zone
+        response = ec2.run_instances(
+            ImageId=spec['ami_id'],
+            MinCount=spec['num_instances'],
+            MaxCount=spec['num_instances'],
+            InstanceType=spec['instance_type'],
+            KeyName=spec['key_name'],
+            SubnetId=spec['subnet_id'],
+            SecurityGroupIds=[spec['security_group_id']],
+            Placement={'AvailabilityZone': spec['availability_zone']},  # Specify the AZ here
+            TagSpecifications=[{
+                'ResourceType': 'instance',
+                'Tags': [{'Key': 'Name', 'Value': f"cluster-{spec['instance_type']}"}]
+            }],
+            Monitoring={'Enabled': True}
+        )
+        return [instance['InstanceId'] for instance in response['Instances']]
+
+    # Issue every run_instances call concurrently
+    with ThreadPoolExecutor(max_workers=len(launch_specs) or 1) as executor:
+        ids_per_spec = list(executor.map(launch, launch_specs))
 
-    instance_ids = [instance['InstanceId'] for instance in response['Instances']]
+    instance_ids = [instance_id for ids in ids_per_spec for instance_id in ids]
     print(f"Created instances: {instance_ids}")
     
-    ec2.get_waiter('instance_running').wait(InstanceIds=instance_ids)
+    ec2.get_waiter('instance_running').wait(InstanceIds=instance_ids, WaiterConfig={'Delay': 5, 'MaxAttempts': 40})
     print(f"Instances are now running: {instance_ids}")
     
+    # A single describe call covers every launched instance
     instances_info = ec2.describe_instances(InstanceIds=instance_ids)
+    status_code = instances_info.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    if status_code != 200:
+        raise Exception(f"describe_instances failed with HTTP status {status_code}")
     
-    instances_data = []
+    public_ips = {}
     for reservation in instances_info['Reservations']:
         for instance in reservation['Instances']:
-            instance_id = instance['InstanceId']
-            public_ip = instance['PublicIpAddress']
-            instances_data.append((instance_id, public_ip))
+            public_ips[instance['InstanceId']] = instance['PublicIpAddress']
+
+    # Group the (ID, Public IP) tuples back by launch spec
+    instances_data = [[(instance_id, public_ips[instance_id]) for instance_id in ids] for ids in ids_per_spec]
     
     print(f"Instances' data (ID, Public IP): {instances_data}")
     
@@ -112,36 +152,49 @@ def create_instances(ec2, ami_id, key_name, subnet_id, security_group_id, instan
 
 
 
-def create_ebs_volumes(ec2, availability_zone, volume_size, num_volumes):
+def create_ebs_volumes(ec2, availability_zone, volume_size, num_volumes, iops=None, throughput=None):
     '''
     Creates the specified number of EBS volumes in the given availability zone.
+    The volumes are created concurrently, then a single waiter waits until all of them are available.
 
     Parameters:
         ec2: A Boto3 EC2 client object to interact with AWS EC2 service.
         availability_zone: The availability zone where the volumes will be created.
         volume_size: The size of each EBS volume in GiB.
         num_volumes: The number of EBS volumes to create.
+        iops: Provisioned IOPS of each gp3 volume (default is None, i.e. the gp3 baseline of 3000).
+        throughput: Provisioned throughput of each gp3 volume in MiB/s (default is None, i.e. the gp3 baseline of 125).
 
     Returns:
         A list of volume IDs for the created EBS volumes.
     '''
-    volume_ids = []
-    for i in range(num_volumes):
+    # Only request a performance above the gp3 baseline when asked to
+    performance_args = {}
+    if iops is not None:
+        performance_args['Iops'] = iops
+    if throughput is not None:
+        performance_args['Throughput'] = throughput
+
+    def create_volume(_):
         volume_response = ec2.create_volume(
             AvailabilityZone=availability_zone,
             Size=volume_size,
-            VolumeType='gp3'
+            VolumeType='gp3',
+            **performance_args
         )
 
         volume_id = volume_response['VolumeId']
         print(f"Created EBS volume {volume_id} in {availability_zone} with size {volume_size} GiB")
-        
-        # Wait for the volume to be available before attaching
-        ec2.get_waiter('volume_available').wait(VolumeIds=[volume_id])
-        print(f"EBS volume {volume_id} is now available.")
+        return volume_id
+
+    # Issue all the create_volume calls concurrently
+    with ThreadPoolExecutor(max_workers=min(num_volumes, 32) or 1) as executor:
+        volume_ids = list(executor.map(create_volume, range(num_volumes)))
 
-        # Add volume ID to the list
-        volume_ids.append(volume_id)
+    # Wait once for all the volumes to be available before attaching
+    if volume_ids:
+        ec2.get_waiter('volume_available').wait(VolumeIds=volume_ids, WaiterConfig={'Delay': 2, 'MaxAttempts': 60})
+        print(f"EBS volumes {volume_ids} are now available.")
 
     return volume_ids
 
@@ -169,22 +222,65 @@ def attach_volume_to_instance(ec2, instance_id, volume_id, device_name='/dev/sdf
     #print(f"Response: {response}")
     print(f"Attached volume {volume_id} to instance {instance_id} as {device_name}")
 
-    # Check the attachment status
+    # Wait until the attachment is complete
     print("Waiting for volume to be attached...")
-    while True:
-        volume_description = ec2.describe_volumes(VolumeIds=[volume_id])
-        attachment_state = volume_description['Volumes'][0]['Attachments'][0]['State']
+    ec2.get_waiter('volume_in_use').wait(
+        VolumeIds=[volume_id],
+        Filters=[{'Name': 'attachment.status', 'Values': ['attached']}],
+        WaiterConfig={'Delay': 2, 'MaxAttempts': 30}
+    )
+    print(f"Volume {volume_id} successfully attached to {instance_id} as {device_name}")
 
-        if attachment_state == 'attached':
-            print(f"Volume {volume_id} successfully attached to {instance_id} as {device_name}")
-            break
-        else:
-            print(f"Volume {volume_id} attachment state: {attachment_state}. Waiting...")
-            time.sleep(5)  # Wait before checking again
-    
 
 
+def create_docker_image(ec2, ami_id, key_name, key_file, subnet_id, security_group_id, availability_zone, image_name='ubuntu-docker-baked'):
+    '''
+    Returns the ID of an AMI that already has Docker Engine installed, so that the workers and the
+    orchestrator skip the apt install of Docker. The image is baked once and reused by name on later runs.
 
+    Parameters:
+        ec2: A Boto3 EC2 client object to interact with AWS EC2 service.
+        ami_id: The base Ubuntu Amazon Machine Image (AMI) ID used to build the image.
+        key_name: The key pair name to associate with the builder instance.
+        key_file: The path to the .pem file used to connect to the builder instance.
+        subnet_id: The subnet ID where the builder instance will be launched.
+        security_group_id: The security group ID to assign to the builder instance.
+        availability_zone: The AZ where the builder instance should be launched.
+        image_name: The name of the baked image (default is 'ubuntu-docker-baked').
 
+    Returns:
+        The ID of the AMI with Docker pre-installed.
 
+    Raises:
+        Exception: If Docker cannot be installed on the builder instance.
+    '''
 
+    # Reuse the image if it was already baked
+    images = ec2.describe_images(
+        Owners=['self'],
+        Filters=[{'Name': 'name', 'Values': [image_name]}, {'Name': 'state', 'Values': ['available']}]
+    )['Images']
+    if images:
+        print(f"Reusing image '{image_name}': {images[0]['ImageId']}")
+        return images[0]['ImageId']
+
+    # Launch a builder instance from the base AMI
+    print(f"Baking image '{image_name}' from {ami_id}...")
+    builder_id, builder_ip = create_instances(ec2, ami_id, key_name, subnet_id, security_group_id,
+                                              't2.micro', 1, availability_zone)[0]
+    try:
+        # Install Docker on the builder instance
+        with RemoteHost(builder_ip, 'ubuntu', key_file) as host:
+            if not host.exec_commands(DOCKER_INSTALL_COMMANDS):
+                raise Exception(f"Could not install Docker on builder instance {builder_id}.")
+
+        # Create the image and wait until it can be used to launch instances
+        image_id = ec2.create_image(InstanceId=builder_id, Name=image_name)['ImageId']
+        ec2.get_waiter('image_available').wait(ImageIds=[image_id], WaiterConfig={'Delay': 15, 'MaxAttempts': 80})
+        print(f"Image '{image_name}' is now available: {image_id}")
+    finally:
+        # The builder instance is no longer needed once the image exists
+        ec2.terminate_instances(InstanceIds=[builder_id])
+
+    # Return the ID of the baked image
+    return image_id
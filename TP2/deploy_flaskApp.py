@@ -1,9 +1,28 @@
 import time
-#for SCP transfer
+#for the jitter between SSH connection attempts
+import random
+#for SSH and SFTP transfer
 import paramiko
 import os
-from scp import SCPClient
-
+#for deploying the workers concurrently
+from concurrent.futures import ThreadPoolExecutor
+#for quoting remote shell scripts
+import shlex
+#for caching the parsed private key
+import functools
+#for the tuned TCP socket under the SSH transport
+import socket
+#for streaming the output of remote commands
+import select
+import sys
+
+# Socket buffers and SSH flow-control settings used for the connections to the instances.
+# The default paramiko window (2MB) and packet size (32KB) throttle the transfer of the container tarballs.
+SOCKET_BUFFER_SIZE = 32 * 1024 * 1024
+SSH_WINDOW_SIZE = 2**31 - 1
+SSH_MAX_PACKET_SIZE = 2**19
+# Size of the chunks read from the local file and written to the pipelined SFTP file
+TRANSFER_CHUNK_SIZE = 1024 * 1024
 
 
 def progress(filename, size, sent):
@@ -26,118 +45,294 @@ def progress(filename, size, sent):
 
 
 
-#SSH Connection 
-def wait_for_ssh(ip_address, username, private_key_path, retries=10, delay=30):
-    """
-    Tries to establish an SSH connection to a given EC2 instance multiple times until successful or retries run out.
-
-    Args:
-    ip_address (str): The public IP address of the EC2 instance.
-    username (str): The SSH username (usually 'ubuntu').
-    private_key_path (str): Path to the private key (.pem) used to authenticate the SSH connection.
-    retries (int): Number of retries before failing (default is 10).
-    delay (int): Delay between retries in seconds (default is 30 seconds).
-
-    Returns:
-    bool: True if SSH connection is successful, False if all retries fail.
-    """
-    key = paramiko.RSAKey.from_private_key_file(private_key_path)
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+# Commands installing Docker Engine on a fresh Ubuntu instance
+DOCKER_INSTALL_COMMANDS = [
+    'sudo apt-get update -y',
+    # 'sudo apt-get install -y python3-pip python3-venv',
+    #Install prerequisite packages for Docker
+    'sudo apt-get install -y ca-certificates curl',
+    #Add Docker’s GPG key
+    'sudo install -m 0755 -d /etc/apt/keyrings',
+    'sudo curl -fsSL https://download.docker.com/linux/ubuntu/gpg -o /etc/apt/keyrings/docker.asc',
+    'sudo chmod a+r /etc/apt/keyrings/docker.asc',
+    # Add the Docker repository
+    'echo \
+  "deb [arch=$(dpkg --print-architecture) signed-by=/etc/apt/keyrings/docker.asc] https://download.docker.com/linux/ubuntu \
+  $(. /etc/os-release && echo "$VERSION_CODENAME") stable" | \
+  sudo tee /etc/apt/sources.list.d/docker.list > /dev/null',
+    # Update the apt package index again to include Docker’s repo
+    'sudo apt-get update -y',
+    # Install Docker Engine, CLI, and required plugins
+    'sudo apt-get install -y docker-ce docker-ce-cli containerd.io docker-buildx-plugin docker-compose-plugin',
+    'sudo docker run hello-world',
+]
 
-    for attempt in range(retries):
-        try:
-            print(f"Attempting SSH connection to {ip_address} (Attempt {attempt+1}/{retries})...")
-            client.connect(hostname=ip_address, username=username, pkey=key, timeout=10)
-            client.close()
-            print(f"SSH connection to {ip_address} successful!")
-            return True
-        except paramiko.ssh_exception.NoValidConnectionsError as e:
-            print(f"SSH connection failed: {e}")
-        except paramiko.AuthenticationException as e:
-            print(f"SSH Authentication failed: {e}")
-        except paramiko.SSHException as e:
-            print(f"General SSH error: {e}")
-        except Exception as e:
-            print(f"Unexpected error: {e}")
-        
-        print(f"Waiting {delay} seconds before retrying...")
-        time.sleep(delay)
-    
-    print(f"Unable to establish SSH connection to {ip_address} after {retries} attempts.")
-    return False
+# Installs Docker only if it is missing, so that instances launched from an image with Docker baked in skip the install
+DOCKER_SETUP_COMMANDS = ['if ! command -v docker > /dev/null; then', *DOCKER_INSTALL_COMMANDS, 'fi']
 
 
-# Function to execute SSH commands via Paramiko
-def ssh_exec_command(ip_address, username, private_key_path, commands):
+# Parses the private key once per process
+@functools.lru_cache(maxsize=None)
+def load_private_key(private_key_path):
     """
-    Executes a list of commands over SSH on the specified EC2 instance.
+    Parses the RSA private key at `private_key_path`, caching the result so that every connection
+    (and every worker deployed concurrently) reuses the same key object instead of decoding the PEM again.
 
     Args:
-    ip_address (str): The public IP address of the EC2 instance.
-    username (str): The SSH username (usually 'ubuntu').
     private_key_path (str): Path to the private key (.pem) used to authenticate the SSH connection.
-    commands (list): A list of shell commands (str) to be executed on the remote EC2 instance.
 
     Returns:
-    None: Outputs the result of the executed commands to the console.
+    paramiko.RSAKey: The parsed private key.
     """
-    key = paramiko.RSAKey.from_private_key_file(private_key_path)
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    client.connect(hostname=ip_address, username=username, pkey=key)
-    
-    for command in commands:
-        print("Command is ",command)
-        stdin, stdout, stderr = client.exec_command(command, get_pty=True)
-        stdout.channel.recv_exit_status()
-        print(stdout.read().decode())
-        print(stderr.read().decode())
-    
-    client.close()
-
+    return paramiko.RSAKey.from_private_key_file(private_key_path)
 
 
-# Function to transfer files via SCP (Paramiko)
-def transfer_file(ip_address, username, private_key_path, local_filepath, remote_filepath):
+# Persistent SSH connection to an EC2 instance
+class RemoteHost:
     """
-    Transfers a file from the local machine to the specified EC2 instance using SCP (via Paramiko),
-    with progress reporting.
+    Keeps a single SSH connection open to an EC2 instance and reuses it for every command
+    and file transfer, instead of opening, authenticating, and closing a connection per call.
+    Use it as a context manager so that the connection is closed when the setup is done.
 
     Args:
     ip_address (str): The public IP address of the EC2 instance.
     username (str): The SSH username (usually 'ubuntu').
-    private_key_path (str): Path to the private key (.pem) used to authenticate the SCP connection.
-    local_filepath (str): The local path to the file that needs to be transferred.
-    remote_filepath (str): The destination path on the EC2 instance where the file should be transferred.
-
-    Returns:
-    None: Transfers the file and displays the progress.
+    private_key_path (str): Path to the private key (.pem) used to authenticate the SSH connection.
     """
-    # Check if local file exists
-    if not os.path.exists(local_filepath):
-        print(f"Local file {local_filepath} does not exist")
-        return
-    
-    # Load the private key
-    key = paramiko.RSAKey.from_private_key_file(private_key_path)
-    
-    # Establish SSH connection
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    client.connect(hostname=ip_address, username=username, pkey=key)
-
-    # Use SCPClient to transfer the file with progress callback
-    print(f"Transferring {local_filepath} to {remote_filepath} on {ip_address}")
-    try:
-        with SCPClient(client.get_transport(), progress=progress) as scp:
-            scp.put(local_filepath, remote_filepath)
+
+    def __init__(self, ip_address, username, private_key_path):
+        self.ip_address = ip_address
+        self.username = username
+        self.private_key_path = private_key_path
+        self.client = None
+
+    def __enter__(self):
+        if self.client is None and not self.connect():
+            raise ConnectionError(f"Unable to establish SSH connection to {self.ip_address}")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Opens one SSH connection over a tuned TCP socket
+    def open_client(self, key, timeout=10):
+        """
+        Opens an SSH connection over a TCP socket with TCP_NODELAY and large send/receive buffers,
+        and a transport using a large window and maximum packet size so that big transfers are not
+        stalled waiting for window adjustments.
+
+        Args:
+        key (paramiko.RSAKey): The parsed private key used to authenticate the SSH connection.
+        timeout (int): Timeout in seconds for the TCP connection and SSH handshake (default is 10 seconds).
+
+        Returns:
+        paramiko.SSHClient: The connected SSH client.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        sock.settimeout(timeout)
+        try:
+            sock.connect((self.ip_address, 22))
+        except OSError:
+            sock.close()
+            raise
+
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            client.connect(
+                hostname=self.ip_address, username=self.username, pkey=key, sock=sock, timeout=timeout,
+                transport_factory=lambda transport_sock, **kwargs: paramiko.Transport(
+                    transport_sock,
+                    default_window_size=SSH_WINDOW_SIZE,
+                    default_max_packet_size=SSH_MAX_PACKET_SIZE,
+                    **kwargs
+                )
+            )
+        except Exception:
+            client.close()
+            sock.close()
+            raise
+        return client
+
+    #SSH Connection 
+    def connect(self, retries=15, initial_delay=2, max_delay=30):
+        """
+        Tries to establish the SSH connection multiple times until successful or retries run out.
+        The delay between attempts starts short and doubles up to `max_delay`, with a random jitter,
+        so that an instance which becomes reachable early is detected early.
+        The connection is then kept alive for the following commands and transfers.
+
+        Args:
+        retries (int): Number of retries before failing (default is 15).
+        initial_delay (float): Delay before the first retry in seconds (default is 2 seconds).
+        max_delay (float): Upper bound of the delay between retries in seconds (default is 30 seconds).
+
+        Returns:
+        bool: True if SSH connection is successful, False if all retries fail.
+        """
+        key = load_private_key(self.private_key_path)
+        delay = initial_delay
+
+        for attempt in range(retries):
+            try:
+                print(f"Attempting SSH connection to {self.ip_address} (Attempt {attempt+1}/{retries})...")
+                client = self.open_client(key, timeout=5)
+                # Send keepalives so the session stays open during long remote commands
+                client.get_transport().set_keepalive(30)
+                self.client = client
+                print(f"SSH connection to {self.ip_address} successful!")
+                return True
+            except paramiko.ssh_exception.NoValidConnectionsError as e:
+                print(f"SSH connection failed: {e}")
+            except paramiko.AuthenticationException as e:
+                print(f"SSH Authentication failed: {e}")
+            except paramiko.SSHException as e:
+                print(f"General SSH error: {e}")
+            except OSError as e:
+                print(f"SSH connection failed: {e}")
+            except Exception as e:
+                print(f"Unexpected error: {e}")
+
+            if attempt + 1 < retries:
+                wait = delay + random.uniform(0, delay * 0.25)
+                print(f"Waiting {wait:.1f} seconds before retrying...")
+                time.sleep(wait)
+                delay = min(delay * 2, max_delay)
+
+        print(f"Unable to establish SSH connection to {self.ip_address} after {retries} attempts.")
+        return False
+
+    def close(self):
+        """
+        Closes the SSH connection if it is open.
+        """
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    # Function to execute SSH commands via Paramiko
+    def exec_commands(self, commands, pty=False):
+        """
+        Executes a list of commands over the SSH connection as a single bash script, so that the whole
+        list costs one channel instead of one per command. The script stops at the first failing command.
+        Its stdout and stderr are printed as they arrive, while the script is still running.
+
+        Args:
+        commands (list or str): A list of shell commands (str), or a single command, to be executed on the remote EC2 instance.
+        pty (bool): Whether to request a pseudo-terminal, only needed by interactive tools (default is False).
+
+        Returns:
+        bool: True if every command succeeded, False otherwise. Outputs the result of the commands to the console.
+        """
+        if isinstance(commands, str):
+            commands = [commands]
+        script = '\n'.join(['set -euo pipefail', *commands])
+        print("Commands are ",commands)
+        channel = self.client.get_transport().open_session()
+        if pty:
+            channel.get_pty()
+        channel.exec_command(f'bash -c {shlex.quote(script)}')
+
+        while True:
+            # Block until the channel has data (or a short timeout) instead of spinning
+            select.select([channel], [], [], 1.0)
+            if channel.recv_ready():
+                sys.stdout.write(channel.recv(65536).decode(errors='replace'))
+                sys.stdout.flush()
+            if channel.recv_stderr_ready():
+                sys.stderr.write(channel.recv_stderr(65536).decode(errors='replace'))
+                sys.stderr.flush()
+            if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                break
+
+        exit_status = channel.recv_exit_status()
+        channel.close()
+        if exit_status != 0:
+            print(f"Commands failed on {self.ip_address} with exit status {exit_status}")
+        return exit_status == 0
+
+    # Function to transfer files via SFTP (Paramiko)
+    def put(self, local_filepath, remote_filepath):
+        """
+        Transfers a file from the local machine to the EC2 instance over SFTP, with progress reporting.
+        The remote file is pipelined so that writes are not acknowledged one by one, and the local file
+        is sent in large chunks through a memoryview to avoid copying the buffer.
+
+        Args:
+        local_filepath (str): The local path to the file that needs to be transferred.
+        remote_filepath (str): The destination path on the EC2 instance where the file should be transferred.
+
+        Returns:
+        None: Transfers the file and displays the progress.
+        """
+        # Check if local file exists
+        if not os.path.exists(local_filepath):
+            print(f"Local file {local_filepath} does not exist")
+            return
+
+        print(f"Transferring {local_filepath} to {remote_filepath} on {self.ip_address}")
+        size = os.path.getsize(local_filepath)
+        sent = 0
+        try:
+            with self.client.open_sftp() as sftp:
+                with sftp.open(remote_filepath, 'wb') as remote_file, open(local_filepath, 'rb') as local_file:
+                    remote_file.set_pipelined(True)
+                    while True:
+                        buffer = local_file.read(TRANSFER_CHUNK_SIZE)
+                        if not buffer:
+                            break
+                        remote_file.write(memoryview(buffer))
+                        sent += len(buffer)
+                        progress(local_filepath, size, sent)
             print("File transfer completed successfully.")
-    except Exception as e:
-        print(f"Failed to transfer file: {e}")
-    
-    # Close SSH connection
-    client.close()
+        except Exception as e:
+            print(f"Failed to transfer file: {e}")
+
+    # Function to stream a docker image archive into `docker load`
+    def load_image(self, local_filepath):
+        """
+        Loads a gzip-compressed docker image archive on the EC2 instance by streaming it through the SSH
+        channel straight into `gzip -dc | sudo docker load`, with progress reporting. The archive is never
+        written to the remote disk, and the upload, decompression and load overlap.
+
+        Args:
+        local_filepath (str): The local path to the .tar.gz docker image archive.
+
+        Returns:
+        bool: True if the image was loaded successfully, False otherwise.
+        """
+        # Check if local file exists
+        if not os.path.exists(local_filepath):
+            print(f"Local file {local_filepath} does not exist")
+            return False
+
+        print(f"Loading {local_filepath} into docker on {self.ip_address}")
+        size = os.path.getsize(local_filepath)
+        sent = 0
+        # No pty here: the channel carries the binary archive
+        stdin, stdout, stderr = self.client.exec_command('gzip -dc | sudo docker load')
+        try:
+            with open(local_filepath, 'rb') as local_file:
+                while True:
+                    buffer = local_file.read(TRANSFER_CHUNK_SIZE)
+                    if not buffer:
+                        break
+                    stdin.write(memoryview(buffer))
+                    sent += len(buffer)
+                    progress(local_filepath, size, sent)
+        except Exception as e:
+            print(f"Failed to transfer image: {e}")
+        # Signal the end of the archive to the remote gzip
+        stdin.channel.shutdown_write()
+        exit_status = stdout.channel.recv_exit_status()
+        print(stdout.read().decode())
+        print(stderr.read().decode())
+        if exit_status != 0:
+            print(f"Loading {local_filepath} failed on {self.ip_address} with exit status {exit_status}")
+        return exit_status == 0
 
 
 
@@ -154,191 +349,133 @@ def setup_ml_app(ip_address, username, private_key_path,container_start_port):
         container_start_port (int): The starting port number for the first container on this worker.
 
     Returns:
-        dict: Information about the worker instance's IP, ports, and statuses for each container.
+        dict: Information about the worker instance's IP, ports, and statuses for each container,
+        or None if the connection, the Docker installation, the image load or the container start failed.
     """
 
-    if not wait_for_ssh(ip_address, username, private_key_path):
+    host = RemoteHost(ip_address, username, private_key_path)
+    if not host.connect():
         print(f"Failed to establish SSH connection to {ip_address}")
         return
-   # Commands to format, mount the volume, and check disk usage
-    
 
-    commands = [
-        "lsblk",#Seeing all disk
-        "sudo mkdir /mnt/ebs",  # Create a mount point
-        "sudo mkfs -t ext4 /dev/xvdf",  # Format it
-        "sudo mount /dev/xvdf /mnt/ebs",  # Now mount volume to newly created directory
-        "sudo chown -R ubuntu:ubuntu /mnt/ebs", #Give permission to Ubuntu use
-        "ls -ld /mnt/ebs", #Verification
-        "df -h"  # Check disk usage to verify the volume is mounted
-    ]
-    ssh_exec_command(ip_address, username, private_key_path, commands)
-    # Installing docker
-    commands = [
-        'sudo apt-get update -y',
-        # 'sudo apt-get install -y python3-pip python3-venv',
-        #Install prerequisite packages for Docker
-        'sudo apt-get install -y ca-certificates curl',
-        #Add Docker’s GPG key
-        'sudo install -m 0755 -d /etc/apt/keyrings',
-        'sudo curl -fsSL https://download.docker.com/linux/ubuntu/gpg -o /etc/apt/keyrings/docker.asc',
-        'sudo chmod a+r /etc/apt/keyrings/docker.asc',
-        # Add the Docker repository
-        'echo \
-  "deb [arch=$(dpkg --print-architecture) signed-by=/etc/apt/keyrings/docker.asc] https://download.docker.com/linux/ubuntu \
-  $(. /etc/os-release && echo "$VERSION_CODENAME") stable" | \
-  sudo tee /etc/apt/sources.list.d/docker.list > /dev/null',
-        # Update the apt package index again to include Docker’s repo
-        'sudo apt-get update -y',
-        # Install Docker Engine, CLI, and required plugins
-        'sudo apt-get install -y docker-ce docker-ce-cli containerd.io docker-buildx-plugin docker-compose-plugin',
-        'sudo docker run hello-world',
-    ]
-    ssh_exec_command(ip_address, username, private_key_path, commands)
-
-    # Transfer tar images
-    transfer_file(ip_address, username, private_key_path, './container1.tar.gz', '/mnt/ebs/container1.tar.gz')
-    #Verifying installation
-    commands=["df -h"]
-    ssh_exec_command(ip_address, username, private_key_path, commands)
-
-    # # Load the Docker image from the tar file
-    
-    commands = ['gzip -dc /mnt/ebs/container1.tar.gz | sudo docker load']
-    ssh_exec_command(ip_address, username, private_key_path, commands)
-
-    # Verify if the Docker image is loaded correctly
-    commands = ['sudo docker images']
-    ssh_exec_command(ip_address, username, private_key_path, commands)
-
-    # Create a dictionary to store container information
-    container_info = {}
-
-    # Run container1 on port `container_start_port`
-    container1_port = container_start_port
-    print(f"Running container1 on port {container1_port}...")
-    commands = [f'sudo docker run -d -p {container1_port}:{container1_port} container1:latest']
-    ssh_exec_command(ip_address, username, private_key_path, commands)
-
-    # Add container1 info to the dictionary
-    container_info['container1'] = {
-        "ip": ip_address,
-        "port": str(container1_port),
-        "status": "free"
-    }
-
-    # Run container2 on port `container_start_port + 1`
-    # Run container2 on port `container_start_port + 1`
-    container2_port = container_start_port + 1
-    print(f"Running container2 on port {container2_port}...")
-    commands = [f'sudo docker run -d --name container2 -p {container2_port}:{container2_port} container1:latest']
-    ssh_exec_command(ip_address, username, private_key_path, commands)
-
-    # Verify if we have 2 containers
-    commands = ['sudo docker ps -a']
-    ssh_exec_command(ip_address, username, private_key_path, commands)
-    # Add container2 info to the dictionary
-    container_info['container2'] = {
-        "ip": ip_address,
-        "port": str(container2_port),
-        "status": "free"
-    }
-
-    # Return the container information for this worker
-    print("Containers successfully started.")
-
-    return container_info
-
-
-def set_up_orchestrator(ip_address, username, private_key_path):
-"""
-Sets up an orchestrator container on a remote EC2 instance.
-The function verifies SSH connectivity, prepares the attached volume,
-installs Docker, loads the orchestrator container from a tar file, and starts it.
-
-Args:
-    ip_address (str): Public IP address of the EC2 instance.
-    username (str): SSH username for the EC2 instance (typically 'ubuntu').
-    private_key_path (str): Path to the private key (.pem) used for SSH authentication.
-
-Steps:
-1. Verify SSH connection to ensure remote access.
-2. Format and mount the EBS volume to make it available for use.
-3. Install Docker and required plugins on the EC2 instance.
-4. Transfer the orchestrator Docker image (tar.gz) to the instance.
-5. Load the Docker image from the tar file into the Docker engine.
-6. Start the orchestrator container, exposing it on port 80.
-7. Verify that the container is running by listing all Docker containers.
-
-Returns:
-    None: The function performs operations directly on the remote instance.
-"""
-    #Verifying ssh connection
-    if not wait_for_ssh(ip_address, username, private_key_path):
-        print(f"Failed to establish SSH connection to {ip_address}")
-        return
-    
-
-    commands = [
-        "lsblk",#Seeing all disk
-        "sudo mkdir /mnt/ebs",  # Create a mount point
-        "sudo mkfs -t ext4 /dev/xvdf",  # Format it
-        "sudo mount /dev/xvdf /mnt/ebs",  # Now mount volume to newly created directory
-        "sudo chown -R ubuntu:ubuntu /mnt/ebs", #Give permission to Ubuntu use
-        "ls -ld /mnt/ebs", #Verification
-        "df -h"  # Check disk usage to verify the volume is mounted
-    ]
-    ssh_exec_command(ip_address, username, private_key_path, commands)
-    # Installing docker
-    commands = [
-        'sudo apt-get update -y',
-        # 'sudo apt-get install -y python3-pip python3-venv',
-        #Install prerequisite packages for Docker
-        'sudo apt-get install -y ca-certificates curl',
-        #Add Docker’s GPG key
-        'sudo install -m 0755 -d /etc/apt/keyrings',
-        'sudo curl -fsSL https://download.docker.com/linux/ubuntu/gpg -o /etc/apt/keyrings/docker.asc',
-        'sudo chmod a+r /etc/apt/keyrings/docker.asc',
-        # Add the Docker repository
-        'echo \
-  "deb [arch=$(dpkg --print-architecture) signed-by=/etc/apt/keyrings/docker.asc] https://download.docker.com/linux/ubuntu \
-  $(. /etc/os-release && echo "$VERSION_CODENAME") stable" | \
-  sudo tee /etc/apt/sources.list.d/docker.list > /dev/null',
-        # Update the apt package index again to include Docker’s repo
-        'sudo apt-get update -y',
-        # Install Docker Engine, CLI, and required plugins
-        'sudo apt-get install -y docker-ce docker-ce-cli containerd.io docker-buildx-plugin docker-compose-plugin',
-        'sudo docker run hello-world',
-    ]
-    ssh_exec_command(ip_address, username, private_key_path, commands)
-
-    # Transfer tar images
-    
-    transfer_file(ip_address, username, private_key_path, './orchestrator.tar.gz', '/mnt/ebs/orchestrator.tar.gz')
-    #Verifying installation
-    commands=["df -h"]
-    ssh_exec_command(ip_address, username, private_key_path, commands)
-
-    # # Load the Docker image from the tar file
-    commands = ['gzip -dc /mnt/ebs/orchestrator.tar.gz | sudo docker load']
-    ssh_exec_command(ip_address, username, private_key_path, commands)
-
-    # Verify if the Docker image is loaded correctly
-    commands = ['sudo docker images']
-    ssh_exec_command(ip_address, username, private_key_path, commands)
-    
-    #run container of orchestrator
-    commands=['sudo docker run -d --name orchestrator_container -p 80:80 orchestrator']
-    ssh_exec_command(ip_address, username, private_key_path, commands)
+    with host:
+        # Install docker (unless already installed)
+        if not host.exec_commands(DOCKER_SETUP_COMMANDS):
+            print(f"Docker installation failed on {ip_address}")
+            return
+
+        # Stream the image archive into docker on the instance
+        if not host.load_image('./container1.tar.gz'):
+            print(f"Failed to load the container image on {ip_address}")
+            return
+
+        # Create a dictionary to store container information
+        container_info = {}
+
+        # container1 runs on port `container_start_port`, container2 on port `container_start_port + 1`
+        container1_port = container_start_port
+        container2_port = container_start_port + 1
+        print(f"Running container1 on port {container1_port} and container2 on port {container2_port}...")
+        commands = [
+            'sudo docker images',  # Verify if the Docker image is loaded correctly
+            f'sudo docker run -d -p {container1_port}:{container1_port} container1:latest',
+            f'sudo docker run -d --name container2 -p {container2_port}:{container2_port} container1:latest',
+            'sudo docker ps -a'  # Verify if we have 2 containers
+        ]
+        if not host.exec_commands(commands):
+            print(f"Failed to start the containers on {ip_address}")
+            return
+
+        # Add container1 info to the dictionary
+        container_info['container1'] = {
+            "ip": ip_address,
+            "port": str(container1_port),
+            "status": "free"
+        }
+
+        # Add container2 info to the dictionary
+        container_info['container2'] = {
+            "ip": ip_address,
+            "port": str(container2_port),
+            "status": "free"
+        }
+
+        # Return the container information for this worker
+        print("Containers successfully started.")
+
+        return container_info
+
+
+# Function to set up the ML app on every worker at the same time
+def setup_ml_workers(worker_ips, username, private_key_path, container_start_port):
+    """
+    Sets up the Docker containers on all the workers concurrently, each worker through its own SSH connection,
+    so that provisioning takes as long as the slowest worker instead of the sum of all of them.
 
-    # Verify if we have 2 containers
-    commands = ['sudo docker ps -a']
-    ssh_exec_command(ip_address, username, private_key_path, commands)
+    Args:
+        worker_ips (list): The public IP addresses of the worker EC2 instances.
+        username (str): The SSH username (usually 'ubuntu').
+        private_key_path (str): Path to the private key (.pem) used for SSH.
+        container_start_port (int): The starting port number for the first container on each worker.
 
+    Returns:
+        list: The container information returned by `setup_ml_app` for each worker, in the order of `worker_ips`
+        (None for a worker whose setup failed).
+    """
+    if not worker_ips:
+        return []
 
-    
+    with ThreadPoolExecutor(max_workers=len(worker_ips)) as executor:
+        return list(executor.map(
+            lambda ip_address: setup_ml_app(ip_address, username, private_key_path, container_start_port),
+            worker_ips
+        ))
 
 
+def set_up_orchestrator(ip_address, username, private_key_path):
+    """
+    Sets up an orchestrator container on a remote EC2 instance.
+    The function verifies SSH connectivity, installs Docker, streams the orchestrator image
+    from its tar.gz archive into Docker, and starts the container.
 
+    Args:
+        ip_address (str): Public IP address of the EC2 instance.
+        username (str): SSH username for the EC2 instance (typically 'ubuntu').
+        private_key_path (str): Path to the private key (.pem) used for SSH authentication.
 
+    Steps:
+    1. Verify SSH connection to ensure remote access.
+    2. Install Docker and required plugins on the EC2 instance.
+    3. Stream the orchestrator Docker image (tar.gz) into the Docker engine, without staging it on disk.
+    4. Start the orchestrator container, exposing it on port 80.
+    5. Verify that the container is running by listing all Docker containers.
 
+    Returns:
+        bool: True if the orchestrator container was started, False if one of the steps failed.
+    """
+    #Verifying ssh connection
+    host = RemoteHost(ip_address, username, private_key_path)
+    if not host.connect():
+        print(f"Failed to establish SSH connection to {ip_address}")
+        return False
+
+    with host:
+        # Install docker (unless already installed)
+        if not host.exec_commands(DOCKER_SETUP_COMMANDS):
+            print(f"Docker installation failed on {ip_address}")
+            return False
+
+        # Stream the image archive into docker on the instance
+        if not host.load_image('./orchestrator.tar.gz'):
+            print(f"Failed to load the orchestrator image on {ip_address}")
+            return False
+
+        commands = [
+            'sudo docker images',  # Verify if the Docker image is loaded correctly
+            'sudo docker run -d --name orchestrator_container -p 80:80 orchestrator',  #run container of orchestrator
+            'sudo docker ps -a'  # Verify if the container is running
+        ]
+        if not host.exec_commands(commands):
+            print(f"Failed to start the orchestrator container on {ip_address}")
+            return False
+        return True